@@ -1,9 +1,9 @@
 # app.py
 import streamlit as st
 import sys, os, uuid, tempfile, time
-from backend.rag_pipeline import add_document_from_file, query_rag, is_fitted
-from openai import OpenAI
+# 登录页只需要这些轻量模块；RAG / embedding / OpenAI 在登录之后才加载（见 load_rag_engine）
 from backend import house_kb
+from backend import ingest_jobs
 from backend import users as user_mod
 import base64
 
@@ -16,9 +16,6 @@ def get_image_base64(path):
         return None
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "backend"))
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-# RAG 接口（与你现有的保持一致）
-from backend.rag_pipeline import add_document_from_file, query_rag, is_fitted
 
 try:
     from backend import tickets as ticket_mod
@@ -158,6 +155,47 @@ if not st.session_state.current_user:
     st.stop()
 
 
+# =========================================================
+# ⚙️ 重量级组件：只有登录后才加载
+# st.cache_resource 让所有会话、所有 rerun 共享同一份（FAISS 分片、embedding 缓存、OpenAI client）
+# =========================================================
+@st.cache_resource(show_spinner="Loading knowledge base engine...")
+def load_rag_engine():
+    from backend import rag_pipeline
+    from backend.llm_client import get_client
+    get_client()                  # 进程内共享的 OpenAI client（连接池复用）
+    ingest_jobs.start_workers()   # house KB 上传的后台摄取 worker（每个进程只启动一次）
+    return rag_pipeline
+
+
+# RAG 接口（与你现有的保持一致）
+rag = load_rag_engine()
+add_document_from_file, query_rag, query_rag_stream = rag.add_document_from_file, rag.query_rag, rag.query_rag_stream
+is_fitted, house_namespace, user_namespace = rag.is_fitted, rag.house_namespace, rag.user_namespace
+
+
+def chat_kb_state(u):
+    """
+    Chat 页面需要的 house KB 概况，缓存在会话里：
+    {"house_ids": [...], "house_kb": 是否至少有一份 house KB 文档}
+    每次 rerun 只读一次 kb_version；版本没变（没有新增 / 删除 house 或 KB 文档）就直接复用，
+    变了才重新做一次聚合查询，租客再确认一次 house KB 都在索引里。
+    """
+    key = (u["id"], u.get("tenant_house_id"), house_kb.kb_version())
+    cached = st.session_state.get("kb_state")
+    if cached and cached["key"] == key:
+        return cached
+
+    state = {"key": key, "house_ids": [], "house_kb": False}
+    if u["role"] == "tenant" and u.get("tenant_house_id"):
+        state["house_ids"] = [u["tenant_house_id"]]
+        state["house_kb"], _ = house_kb.load_house_kb_into_rag(u["tenant_house_id"])
+    elif u["role"] == "landlord":
+        houses = house_kb.houses_with_doc_counts(u["id"])
+        state["house_ids"] = [h["id"] for h in houses]
+        state["house_kb"] = any(h["doc_count"] for h in houses)
+    st.session_state.kb_state = state
+    return state
 
 # =========================================================
 # (以下是主应用界面，只有登录后才会运行)
@@ -390,18 +428,11 @@ if uploaded_file:
     if st.sidebar.button("Index Document"):
         try:
             with st.spinner("Extracting & indexing..."):
-                # Determine file type
-                lower = uploaded_file.name.lower()
-                if lower.endswith(".pdf"):
-                    add_document_from_file(uploaded_file, file_type="pdf")
-                else:
-                    # read as text
-                    content = uploaded_file.read()
-                    try:
-                        text = content.decode("utf-8")
-                    except:
-                        text = content.decode("latin-1", errors="ignore")
-                    add_document_from_file(text, file_type="txt")
+                # 合同写入当前用户自己的索引分片
+                ns = user_namespace(st.session_state.current_user["username"])
+                # 按扩展名交给统一抽取服务（pdf / docx / 图片 / 纯文本）
+                file_type = os.path.splitext(uploaded_file.name)[1].lstrip(".").lower() or "txt"
+                add_document_from_file(uploaded_file.getvalue(), file_type=file_type, namespace=ns)
                 st.session_state.doc_uploaded = True
                 st.sidebar.success("Indexed")
         except Exception as e:
@@ -484,14 +515,11 @@ page = st.sidebar.radio(
 if page == "💬 Chat":
     u = st.session_state.current_user
 
+    kb_state = chat_kb_state(u)
+
     if u["role"] == "tenant" and u.get("tenant_house_id"):
-        loaded, msg = house_kb.load_house_kb_into_rag(u["tenant_house_id"])
-        if loaded:
+        if kb_state["house_kb"]:
             st.session_state.doc_uploaded = True  # 告诉系统“已经有知识库”
-        else:
-            st.warning(msg)
-        docs = house_kb.get_house_docs(u["tenant_house_id"])
-        if docs:
             st.info(f"🏠 Using knowledge base for house ID {u['tenant_house_id']}")
         else:
             st.warning("⚠️ This house has no knowledge base.")
@@ -509,19 +537,16 @@ if page == "💬 Chat":
     # 1️⃣ 判断是否有“至少一个可用知识库”
     # =========================
 
-    # 用户自己是否上传过文档？
-    has_user_doc = is_fitted()
+    # 本次会话只检索属于该用户的分片：自己的合同 + 所住 / 所拥有 house 的 KB
+    rag_namespaces = [user_namespace(u["username"])]
 
-    # 租客是否绑定了房屋？
-    tenant_house_kb = False
-    if u["role"] == "tenant" and u.get("tenant_house_id"):
-        tenant_house_kb = house_kb.has_house_kb(u["tenant_house_id"])
+    # 用户自己是否上传过文档？
+    has_user_doc = is_fitted(rag_namespaces[0])
 
-    # 房东是否有自己的房屋知识库？
-    landlord_kb = False
-    if u["role"] == "landlord":
-        houses = house_kb.list_houses(u["id"])
-        landlord_kb = any(house_kb.has_house_kb(h["id"]) for h in houses)
+    # 租客所住 / 房东所拥有的 house 是否有 KB（见 chat_kb_state，会话内按 kb_version 缓存）
+    rag_namespaces.extend(house_namespace(hid) for hid in kb_state["house_ids"])
+    tenant_house_kb = u["role"] == "tenant" and kb_state["house_kb"]
+    landlord_kb = u["role"] == "landlord" and kb_state["house_kb"]
 
     # 最终判断：是否至少存在一个可以用于回答的知识库？
     kb_available = has_user_doc or tenant_house_kb or landlord_kb
@@ -551,14 +576,15 @@ if page == "💬 Chat":
                 }
                 st.success("🧾 I detected that you want to create a maintenance ticket. Please fill in the details below 👇")
             else:
-                # Step 2️⃣ — 正常问答
-                with st.spinner("Retrieving and generating answer..."):
+                # Step 2️⃣ — 正常问答（流式输出，首个 token 到达即开始渲染）
+                with st.chat_message("assistant"):
                     try:
-                        answer = query_rag(prompt, top_k=3)
+                        answer = st.write_stream(
+                            query_rag_stream(prompt, top_k=3, namespace=rag_namespaces)
+                        )
                     except Exception as e:
                         answer = f"Error during query: {e}"
-                with st.chat_message("assistant"):
-                    st.markdown(answer)
+                        st.markdown(answer)
                 st.session_state.messages.append({"role": "assistant", "content": answer})
 
         # Step 3️⃣ — 工单草稿表单（仅在检测到创建意图时出现）
@@ -789,18 +815,34 @@ elif page == "🏠 Landlord Panel":
         else:
             st.info("No documents yet.")
 
+        # ---- 后台摄取任务状态 ----
+        jobs = ingest_jobs.list_jobs(h["id"], limit=10)
+        if jobs:
+            status_icon = {"queued": "⏳", "parsing": "📄", "embedding": "🧠", "done": "✅", "failed": "❌"}
+            with st.expander(f"📥 Ingestion jobs ({sum(j['status'] in ingest_jobs.ACTIVE_STATUSES for j in jobs)} in progress)"):
+                for j in jobs:
+                    line = f"{status_icon.get(j['status'], '•')} `{j['filename']}` — **{j['status']}** (attempt {j['attempts']}/{ingest_jobs.MAX_ATTEMPTS})"
+                    st.markdown(line)
+                    if j["status"] == "failed":
+                        st.caption(j["error"] or "")
+                        if st.button("Retry", key=f"retry_job_{j['id']}"):
+                            ingest_jobs.retry_job(j["id"])
+                            st.rerun()
+                if st.button("🔄 Refresh status", key=f"refresh_jobs_{h['id']}"):
+                    st.rerun()
+
         # ---- 文件上传器 ----
         up = st.file_uploader(
             f"Upload Knowledge File for {h['house_name']}",
-            type=["pdf", "txt"],
+            type=["pdf", "txt", "docx", "png", "jpg", "jpeg"],
             key=f"upload_{h['id']}"
         )
 
         # ---- 上传 ----
         if up and st.button(f"Add to KB ({h['house_name']})", key=f"btn_{h['id']}"):
             file_bytes = up.read()
-            house_kb.upload_house_document(h["id"], file_bytes, up.name)
-            st.success("📘 File uploaded and added to Knowledge Base!")
+            job_id = house_kb.upload_house_document(h["id"], file_bytes, up.name)
+            st.success(f"📘 File uploaded — queued for indexing (job #{job_id}).")
             st.session_state["refresh_kb"] = True
             st.rerun()
 
@@ -816,30 +858,33 @@ elif page == "🏠 Landlord Panel":
     # ============================================
     st.subheader("🛠 Tenant Maintenance Tickets")
 
-    # ---- 获取所有属于 landlord 的租客 ----
-    conn = ticket_mod.get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT username FROM users WHERE landlord_id=?", (landlord_id,))
-    tenant_names = [r["username"] for r in cur.fetchall()]
-    conn.close()
-
-    if not tenant_names:
-        st.info("You have no tenants yet.")
-        st.stop()
-
-    placeholders = ",".join(["?"] * len(tenant_names))
-    query = f"SELECT * FROM tickets WHERE creator IN ({placeholders}) ORDER BY created_at DESC"
-
-    conn = ticket_mod.get_conn()
-    cur = conn.cursor()
-    cur.execute(query, tenant_names)
-    tickets = [dict(r) for r in cur.fetchall()]
-    conn.close()
+    # ---- 分页获取租客工单（单条 JOIN 查询 + 短 TTL 缓存，见 tickets.landlord_ticket_feed）----
+    status_filter = st.selectbox("Status", ["all", *ticket_mod.TICKET_STATUSES], key="ticket_status_filter")
+    status = None if status_filter == "all" else status_filter
+    # 游标栈：第 n 页的起点是栈顶；切换状态过滤时回到第一页
+    if st.session_state.get("ticket_feed_filter") != status_filter:
+        st.session_state.ticket_feed_filter = status_filter
+        st.session_state.ticket_cursors = [None]
+    cursors = st.session_state.ticket_cursors
+    tickets, next_cursor = ticket_mod.landlord_ticket_feed(landlord_id, status=status, cursor=cursors[-1])
 
     if not tickets:
-        st.info("Your tenants have not submitted any tickets.")
+        st.info("Your tenants have not submitted any tickets."
+                if status is None else f"No {status} tickets.")
         st.stop()
 
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if len(cursors) > 1 and st.button("⬅️ Newer", key="tickets_prev"):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Page {len(cursors)}")
+    with col_next:
+        if next_cursor and st.button("Older ➡️", key="tickets_next"):
+            cursors.append(next_cursor)
+            st.rerun()
+
     # ---- 展示工单 ----
     for t in tickets:
         st.markdown(f"**#{t['id']} {t['title']}** — by {t['creator']} ({t['priority']})")
@@ -0,0 +1,79 @@
+# backend/answer_cache.py
+"""
+语义答案缓存：
+新问题的 embedding 与同一知识库版本下某个已缓存问题的余弦相似度 ≥ threshold 时，
+直接复用之前的答案，省掉检索 + gpt-4o 的整轮调用。
+条目按 LRU + TTL 淘汰；知识库版本变化（上传 / 删除文档）后旧条目自然失效，
+也可以按 namespace 主动 invalidate。
+"""
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, max_entries: int = 512, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()   # id -> (scope, version, unit vec, answer, created_at)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vec):
+        v = np.asarray(vec, dtype="float32").ravel()
+        return v / (np.linalg.norm(v) + 1e-12)
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def lookup(self, scope, version, q_vec):
+        """命中返回缓存的答案，否则返回 None"""
+        q = self._unit(q_vec)
+        now = time.time()
+        best_id, best_sim = None, self.threshold
+        with self._lock:
+            for eid, (s, v, vec, _, created_at) in list(self._entries.items()):
+                if self._expired(created_at, now):
+                    del self._entries[eid]
+                    continue
+                if s != scope or v != version:
+                    continue
+                sim = float(vec @ q)
+                if sim >= best_sim:
+                    best_id, best_sim = eid, sim
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][3]
+
+    def store(self, scope, version, q_vec, answer):
+        with self._lock:
+            self._entries[self._next_id] = (scope, version, self._unit(q_vec), answer, time.time())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, namespace=None):
+        """丢弃 scope 中包含 namespace 的条目；namespace 为 None 时清空"""
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+                return
+            for eid in [eid for eid, e in self._entries.items() if namespace in e[0]]:
+                del self._entries[eid]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
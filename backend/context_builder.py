@@ -0,0 +1,152 @@
+# backend/context_builder.py
+"""
+检索结果 → LLM context：
+1. 同一文档里原文位置相邻 / 重叠的 chunk 按偏移（metadata["start"]）合并成一段，去掉 chunk overlap 带来的重复文字
+2. 几乎相同的段落（如租客合同和 house KB 里的同一条款）只保留一段
+3. 按相关度依次装入 token 预算（用 ingest.count_tokens 计数，与 prompt 统计同一个 tokenizer），放不下的跳过，剩余预算足够时截断后放入
+4. 输出时按文档内位置排序：同一文档的段落按原文顺序，文档之间按其最相关段落的名次
+没有偏移信息的 chunk（旧索引）不参与合并，其余步骤照常。
+"""
+import re
+from typing import List, Tuple
+from backend.ingest import count_tokens, get_encoding
+
+SEPARATOR = "\n\n"
+MERGE_GAP = 1                 # 两个 chunk 之间最多隔几个字符（切分时去掉的换行 / 空格）仍视为相邻
+NEAR_DUP_THRESHOLD = 0.85     # 词 shingle 重合度（交集 / 较小集合）≥ 该值视为重复
+SHINGLE_SIZE = 5
+MIN_TRUNCATED_TOKENS = 64     # 剩余预算不足这么多时不再截断放入
+
+# 最近一次 build_context 的统计（passages / duplicates / tokens / tokens_saved 等）
+last_stats = {}
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    enc = get_encoding()
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:max_tokens])
+    return text[: max(0, (max_tokens - 1) * 4)]   # 与 count_tokens 的估算口径一致
+
+
+def _merge_adjacent(hits) -> List[dict]:
+    """hits: [(metadata, score)]（按相关度排序）→ 段落列表；同一文档中相邻 / 重叠的 chunk 合并为一段"""
+    passages, by_doc = [], {}
+    for rank, (m, score) in enumerate(hits):
+        text = m.get("text", "")
+        start = m.get("start")
+        p = {
+            "doc_id": m.get("doc_id"),
+            "start": start,
+            "end": start + len(text) if start is not None else None,
+            "text": text,
+            "rank": rank,
+            "score": score,
+            "chunks": 1,
+        }
+        if start is None:
+            passages.append(p)
+        else:
+            by_doc.setdefault(p["doc_id"], []).append(p)
+
+    for doc_passages in by_doc.values():
+        doc_passages.sort(key=lambda p: p["start"])
+        cur = doc_passages[0]
+        for p in doc_passages[1:]:
+            if p["start"] > cur["end"] + MERGE_GAP:
+                passages.append(cur)
+                cur = p
+                continue
+            if p["end"] > cur["end"]:
+                overlap = cur["end"] - p["start"]
+                cur["text"] += p["text"][overlap:] if overlap >= 0 else " " + p["text"]
+                cur["end"] = p["end"]
+            cur["rank"] = min(cur["rank"], p["rank"])
+            cur["score"] = max(cur["score"], p["score"])
+            cur["chunks"] += p["chunks"]
+        passages.append(cur)
+    return passages
+
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _drop_near_duplicates(passages: List[dict]) -> Tuple[List[dict], int]:
+    """按相关度从高到低保留段落；与已保留段落几乎相同的丢弃（若它更完整则替换掉那一段，名次取两者较好的）"""
+    kept, dropped = [], 0
+    for p in sorted(passages, key=lambda p: p["rank"]):
+        sh = _shingles(p["text"])
+        dup = None
+        for k in kept:
+            common = len(sh & k["shingles"])
+            if common and common / min(len(sh), len(k["shingles"])) >= NEAR_DUP_THRESHOLD:
+                dup = k
+                break
+        if dup is None:
+            p["shingles"] = sh
+            kept.append(p)
+            continue
+        dropped += 1
+        if len(p["text"]) > len(dup["text"]):
+            rank = dup["rank"]
+            dup.update(p, shingles=sh, rank=rank)
+    return kept, dropped
+
+
+def build_context(hits, token_budget: int = None) -> Tuple[str, dict]:
+    """
+    hits: search_chunks 的结果 [(metadata, score)]，按相关度排序。
+    返回 (context, stats)；stats["tokens_saved"] 为相比直接用 SEPARATOR 拼接全部 chunk 少用的 token 数。
+    token_budget 为 None 时不限制长度（只合并、去重、排序）。
+    """
+    global last_stats
+    if not hits:
+        last_stats = {"chunks": 0, "passages": 0, "tokens": 0, "tokens_naive": 0, "tokens_saved": 0}
+        return "", dict(last_stats)
+
+    merged = _merge_adjacent(hits)
+    passages, duplicates = _drop_near_duplicates(merged)
+
+    sep_tokens = count_tokens(SEPARATOR)
+    selected, used, truncated = [], 0, False
+    for p in passages:   # 已按相关度排序
+        n = count_tokens(p["text"]) + (sep_tokens if selected else 0)
+        if token_budget is None or used + n <= token_budget:
+            selected.append(p)
+            used += n
+            continue
+        remaining = token_budget - used - (sep_tokens if selected else 0)
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            p["text"] = _truncate(p["text"], remaining)
+            selected.append(p)
+            used = token_budget
+            truncated = True
+
+    # 文档之间按最相关段落的名次，文档内按原文位置（没有偏移的按名次）
+    doc_rank = {}
+    for p in selected:
+        doc_rank[p["doc_id"]] = min(doc_rank.get(p["doc_id"], p["rank"]), p["rank"])
+    selected.sort(key=lambda p: (
+        doc_rank[p["doc_id"]],
+        p["start"] if p["start"] is not None else float("inf"),
+        p["rank"],
+    ))
+    context = SEPARATOR.join(p["text"] for p in selected)
+
+    naive = count_tokens(SEPARATOR.join(m.get("text", "") for m, _ in hits))
+    tokens = count_tokens(context)
+    last_stats = {
+        "chunks": len(hits),
+        "passages": len(selected),
+        "merged": len(hits) - len(merged),
+        "duplicates": duplicates,
+        "over_budget": len(passages) - len(selected),
+        "truncated": truncated,
+        "tokens": tokens,
+        "tokens_naive": naive,
+        "tokens_saved": naive - tokens,
+    }
+    return context, dict(last_stats)
@@ -1,22 +1,147 @@
 # backend/db.py
+"""
+SQLite 访问层：
+- 连接池：连接建好后放回池子复用，不再每次调用都 sqlite3.connect + 设置 pragma
+- WAL 日志 + busy_timeout：读写可以并发，写写冲突时等待而不是立刻报 "database is locked"
+- connection() / transaction() 上下文管理器：用完自动归还；transaction() 成功提交、异常回滚
+连接以 autocommit 模式打开（isolation_level=None），事务边界只由 transaction() 决定。
+"""
 import sqlite3
 import os
-from contextlib import closing
+import queue
+import threading
+from contextlib import closing, contextmanager
 from datetime import datetime
 import hashlib
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "../data/sp3-4.db")
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+# ===========================================
+# 🔧 连接参数
+# ===========================================
+POOL_SIZE = 8                 # 池中最多保留的空闲连接数（超出的用完即关闭）
+BUSY_TIMEOUT_MS = 10_000      # 写锁被占用时最多等待的时间
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",     # WAL 下 NORMAL 足够安全，写入少一次 fsync
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",      # 16 MB page cache / 连接
+    "PRAGMA mmap_size=134217728",    # 128 MB
+)
+# ===========================================
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db():
+
+def _acquire():
+    if not _schema_ready:
+        init_db()
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+
+def _release(conn):
+    try:
+        if conn.in_transaction:   # 调用方忘了提交 / 中途异常：不把未完成的事务带给下一个使用者
+            conn.rollback()
+        _pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.close()
+
+
+class PooledConnection:
+    """
+    get_conn() 的返回值：用法与 sqlite3.Connection 相同，close() 时把连接还回池子。
+    旧代码里 "conn = get_conn() ... conn.close()" 的写法不用改也能复用连接。
+    """
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            _release(self._conn)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):   # 忘记 close() 的连接也会回到池子，而不是泄漏
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def get_conn():
+    """从池中取一个连接（用完调用 close() 归还）；第一次调用时才建表"""
+    return PooledConnection(_acquire())
+
+
+@contextmanager
+def connection():
+    """with connection() as conn: ... —— 只读或单条语句（autocommit）时使用"""
+    conn = get_conn()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def transaction(immediate: bool = True):
+    """
+    with transaction() as conn: ... —— 块内的语句在同一个事务中，正常结束提交，异常回滚。
+    immediate=True 时一开始就拿写锁（BEGIN IMMEDIATE），避免读后写升级时的死锁。
+    """
     conn = get_conn()
-    cur = conn.cursor()
+    try:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ===========================================
+# 🧱 Schema 迁移
+# ===========================================
+# 版本号记录在 PRAGMA user_version 中；每个迁移在自己的写事务里执行并更新版本号，
+# 所以只会执行一次，多个进程同时启动也不会重复执行。
+# 新的表结构变更：在 MIGRATIONS 末尾追加 (版本号, 说明, 函数)，不要修改已发布的迁移。
+
+def _has_column(cur, table, column):
+    return any(r["name"] == column for r in cur.execute(f"PRAGMA table_info({table})").fetchall())
+
 
+def _m1_base_tables(cur):
     # ---- 用户表 ----
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -73,14 +198,115 @@ def init_db():
         );
     """)
 
-    # ---- 用户表补丁：添加 tenant_house_id（如已存在则无视） ----
-    try:
+    # ---- 用户表补丁：旧库可能缺少 tenant_house_id ----
+    if not _has_column(cur, "users", "tenant_house_id"):
         cur.execute("ALTER TABLE users ADD COLUMN tenant_house_id INTEGER;")
-    except:
-        pass
 
-    conn.commit()
-    conn.close()
+
+def _m2_ingest_jobs(cur):
+    # ---- 后台摄取任务（house KB 上传后的解析 + embedding） ----
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            house_id INTEGER NOT NULL,
+            filename TEXT,
+            file_path TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            status TEXT DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            doc_row_id INTEGER,
+            next_run_at TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            FOREIGN KEY (house_id) REFERENCES houses(id)
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, next_run_at);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_house ON ingest_jobs (house_id, content_hash);")
+
+
+def _m3_lookup_indexes(cur):
+    # 工单：按提交人 / 状态过滤并按时间倒序；房东面板还会按时间分页
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_creator_created ON tickets (creator, created_at);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_status_created ON tickets (status, created_at);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_created ON tickets (created_at);")
+    # 房源 / KB 文档 / 租客：按外键查找；(landlord_id, username) 让“列出租客名”只读索引
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_houses_landlord_created ON houses (landlord_id, created_at);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_house_documents_house ON house_documents (house_id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_landlord_username ON users (landlord_id, username);")
+    cur.execute("ANALYZE;")
+
+
+def _m4_kb_version(cur):
+    # 单行计数器：house / house KB 文档每次变更 +1，Chat 页面据此判断会话里缓存的 KB 概况是否过期
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS kb_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+    """)
+    cur.execute("INSERT OR IGNORE INTO kb_version (id, version) VALUES (1, 0);")
+
+
+def _m5_ticket_landlord(cur):
+    # 工单直接记录所属房东（提交时租客的 landlord_id），房东面板按 (landlord_id, [status,] created_at, id)
+    # 走一段有界的索引范围做 keyset 分页，不再 JOIN users 后对该房东的全部工单排序
+    if not _has_column(cur, "tickets", "landlord_id"):
+        cur.execute("ALTER TABLE tickets ADD COLUMN landlord_id INTEGER;")
+    cur.execute("""
+        UPDATE tickets SET landlord_id = (SELECT u.landlord_id FROM users u WHERE u.username = tickets.creator)
+        WHERE landlord_id IS NULL
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_landlord_created ON tickets (landlord_id, created_at, id);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tickets_landlord_status_created ON tickets (landlord_id, status, created_at, id);"
+    )
+    cur.execute("ANALYZE;")
+
+
+MIGRATIONS = [
+    (1, "base tables", _m1_base_tables),
+    (2, "ingest job queue", _m2_ingest_jobs),
+    (3, "secondary indexes for ticket / house lookups", _m3_lookup_indexes),
+    (4, "KB version counter", _m4_kb_version),
+    (5, "tickets.landlord_id for the landlord feed", _m5_ticket_landlord),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """把数据库升级到 SCHEMA_VERSION，返回执行过的迁移版本号"""
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 拿到写锁后再确认一次：其他进程可能刚执行完这个迁移
+            if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                fn(conn.cursor())
+                conn.execute(f"PRAGMA user_version={version}")
+                applied.append(version)
+                print(f"[db] Applied migration {version}: {description}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return applied
+
+
+def init_db():
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        conn = _connect()
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+        _schema_ready = True
 
 
 # convenience: create a user if not exists
@@ -98,7 +324,7 @@ def ensure_user(username: str, role: str, password: str = None, landlord_usernam
     可选支持密码与绑定房东关系。
     返回用户 id。
     """
-    with closing(get_conn()) as conn:
+    with transaction() as conn:
         cur = conn.cursor()
         now = datetime.utcnow().isoformat()
 
@@ -126,10 +352,59 @@ def ensure_user(username: str, role: str, password: str = None, landlord_usernam
             INSERT INTO users (username, password, role, landlord_id)
             VALUES (?, ?, ?, ?)
         """, (username, hashed, role, landlord_id))
-
-        conn.commit()
         return cur.lastrowid
 
 
-# call init on import
-init_db()
+
+# ===========================================
+# 🔍 热点查询的执行计划检查
+# ===========================================
+# 登录、房东面板、工单列表等每次页面渲染都会执行的查询；任何一条出现全表 SCAN 都算回归。
+HOT_QUERIES = {
+    "user by name": ("SELECT * FROM users WHERE username=?", ("alice",)),
+    "tenants of landlord": ("SELECT username FROM users WHERE landlord_id=?", (1,)),
+    "tickets by creator": ("SELECT * FROM tickets WHERE creator=? ORDER BY created_at DESC", ("alice",)),
+    "tickets by status": ("SELECT * FROM tickets WHERE status=? ORDER BY created_at DESC", ("open",)),
+    "landlord ticket feed (first page)": (
+        "SELECT * FROM tickets WHERE landlord_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+        (1, 21),
+    ),
+    "landlord ticket feed (next page)": (
+        "SELECT * FROM tickets WHERE landlord_id = ? AND (created_at, id) < (?, ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT ?",
+        (1, "9999", 0, 21),
+    ),
+    "landlord ticket feed (status, next page)": (
+        "SELECT * FROM tickets WHERE landlord_id = ? AND status = ? AND (created_at, id) < (?, ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT ?",
+        (1, "open", "9999", 0, 21),
+    ),
+    "houses of landlord": ("SELECT * FROM houses WHERE landlord_id=? ORDER BY created_at DESC", (1,)),
+    "house documents": ("SELECT * FROM house_documents WHERE house_id=?", (1,)),
+    "house document count": ("SELECT COUNT(*) AS c FROM house_documents WHERE house_id=?", (1,)),
+    "houses with document counts": (
+        "SELECT h.*, COUNT(d.id) AS doc_count FROM houses h "
+        "LEFT JOIN house_documents d ON d.house_id = h.id "
+        "WHERE h.landlord_id=? GROUP BY h.id ORDER BY h.created_at DESC",
+        (1,),
+    ),
+}
+
+
+def query_plans(conn=None):
+    """{查询名: [EXPLAIN QUERY PLAN 的每一行 detail]}"""
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        return {
+            name: [r["detail"] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+            for name, (sql, params) in HOT_QUERIES.items()
+        }
+    finally:
+        if own:
+            conn.close()
+
+
+# 分页查询：每页的代价必须与翻到第几页无关，除了不能 SCAN 还不能为 ORDER BY 临时排序
+# （tests/test_query_plans.py 对迁移后的空库检查这两条）
+PAGINATED_QUERIES = {name for name in HOT_QUERIES if name.startswith("landlord ticket feed")}
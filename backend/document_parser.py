@@ -1,5 +1,17 @@
 # document_parser.py
+"""
+统一的文本抽取服务：Streamlit 侧边栏、house_kb、API、validate_rag 都走 extract_text()。
+- PDF：先用 PyMuPDF 读文字层（最快），只有空白页才按页回退到 pdfplumber，再不行才 OCR
+- docx / 图片 / 纯文本：按扩展名分发（parse_file）
+- 结果按文件内容哈希缓存在 data/extract_cache（每行一页），同一文件只解析一次
+"""
 import io
+import json
+import hashlib
+try:
+    import pymupdf as fitz  # PyMuPDF ≥ 1.24.3 的正式模块名
+except ImportError:
+    import fitz  # 旧版本只有 fitz
 import pdfplumber
 from docx import Document
 from PIL import Image
@@ -10,27 +22,146 @@ os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["MKL_NUM_THREADS"] = "1"
 os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
 
-from typing import List
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
+from backend import tracing
 
 # If tesseract is not in PATH, you may need to set:
 # pytesseract.pytesseract.tesseract_cmd = r"/usr/bin/tesseract"
 
-def parse_pdf(file_bytes: bytes) -> str:
-    text_parts = []
-    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-        for page in pdf.pages:
-            txt = page.extract_text()
-            if txt:
-                text_parts.append(txt)
+# ===========================================
+# 🔧 PDF 并行解析参数
+# 每个进程内保持单线程（上面的 *_NUM_THREADS=1），并行度由进程数决定，避免超订 CPU
+# ===========================================
+PDF_TEXT_WORKERS = max(1, (os.cpu_count() or 2))          # 抽取文字层的进程数
+PDF_OCR_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))   # 同时 OCR 的进程数上限（OCR 很吃 CPU / 内存）
+PDF_PARALLEL_MIN_PAGES = 32    # 页数少于该值时串行抽取文字层（PyMuPDF 很快，起进程反而更慢）；不影响 OCR 进程池
+PDF_RANGE_PAGES = 8            # 并行时每个任务处理的连续页数
+OCR_RESOLUTION = 150
+
+# 最近一次 parse_pdf / iter_pdf_pages 的统计：文字页 / OCR 页的数量、耗时与 pages/sec
+last_parse_stats = {}
+
+_worker_pdf_bytes = None
+
+
+def _init_worker(file_bytes: bytes):
+    # 每个 worker 进程只接收一次 PDF 字节，而不是每个任务都传一遍
+    global _worker_pdf_bytes
+    _worker_pdf_bytes = file_bytes
+
+
+def _extract_text_range(start: int, end: int, file_bytes: bytes = None):
+    """
+    抽取 [start, end) 页的文字层，返回 [(页码, 文本或 None)]。
+    PyMuPDF 优先；PyMuPDF 读不到文字的页才用 pdfplumber 再试一次。
+    """
+    data = file_bytes if file_bytes is not None else _worker_pdf_bytes
+    out = []
+    plumber = None
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        for i in range(start, end):
+            txt = doc[i].get_text().strip()
+            if not txt:
+                if plumber is None:
+                    plumber = pdfplumber.open(io.BytesIO(data))
+                txt = (plumber.pages[i].extract_text() or "").strip()
+            out.append((i, txt or None))
+    if plumber is not None:
+        plumber.close()
+    return out
+
+
+def _ocr_page(i: int, file_bytes: bytes = None):
+    """对没有文字层的一页做 OCR，失败返回 None"""
+    data = file_bytes if file_bytes is not None else _worker_pdf_bytes
+    try:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            pix = doc[i].get_pixmap(dpi=OCR_RESOLUTION)
+            im = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        return i, pytesseract.image_to_string(im)
+    except Exception:
+        return i, None
+
+
+def _page_ranges(n: int, size: int):
+    return [(s, min(s + size, n)) for s in range(0, n, size)]
+
+
+def iter_pdf_pages(file_bytes: bytes, max_workers: int = None, max_ocr_workers: int = None):
+    """
+    按页序逐页 yield 文本（不把整本文档拼成一个字符串）：
+    1. 文字层（PyMuPDF，空白页回退 pdfplumber），按页段处理，页数多时多进程并行；
+    2. 仍没有文字的页才 OCR：不止一页需要 OCR 时用进程池，并发数受 PDF_OCR_WORKERS 限制。
+    后面的页段在后台继续解析，调用方可以边拿页边分块 / embedding。
+    OCR 失败的页跳过（与原来的行为一致）。
+    """
+    global last_parse_stats
+    max_workers = max_workers or PDF_TEXT_WORKERS
+    max_ocr_workers = max_ocr_workers or PDF_OCR_WORKERS
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        n_pages = doc.page_count
+    parallel = n_pages >= PDF_PARALLEL_MIN_PAGES and max_workers > 1
+    stats = {"pages": n_pages, "text_pages": 0, "ocr_pages": 0, "text_seconds": 0.0, "ocr_seconds": 0.0}
+    ranges = _page_ranges(n_pages, PDF_RANGE_PAGES)
+
+    text_pool = ocr_pool = None
+    if parallel:
+        text_pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(file_bytes,))
+        parts = text_pool.map(_extract_text_range, *zip(*ranges))   # 结果按页序返回
+    else:
+        # 串行时每个页段只打开一次文档
+        parts = (_extract_text_range(start, end, file_bytes) for start, end in ranges)
+
+    try:
+        ocr_seen = 0
+        while True:
+            t0 = time.perf_counter()
+            part = next(parts, None)
+            stats["text_seconds"] += time.perf_counter() - t0
+            if part is None:
+                break
+            # OCR 与文字层的并行与否无关：不止一页需要 OCR 时（扫描件）就用进程池，
+            # 只有偶尔一页空白（如签名页）时在本进程里做，省掉起进程的开销
+            need_ocr = [i for i, txt in part if txt is None]
+            ocr_seen += len(need_ocr)
+            if ocr_pool is None and ocr_seen > 1 and max_ocr_workers > 1:
+                ocr_pool = ProcessPoolExecutor(
+                    max_workers=max_ocr_workers, initializer=_init_worker, initargs=(file_bytes,)
+                )
+            # 先把本页段里需要 OCR 的页全部提交，再按页序取结果
+            if ocr_pool is not None:
+                futures = {i: ocr_pool.submit(_ocr_page, i) for i in need_ocr}
             else:
-                # fallback: try OCR of page image
-                try:
-                    im = page.to_image(resolution=150).original
-                    ocr_txt = pytesseract.image_to_string(im)
-                    text_parts.append(ocr_txt)
-                except Exception:
-                    pass
-    return "\n".join(text_parts)
+                futures = {}
+            for i, txt in part:
+                if txt is not None:
+                    stats["text_pages"] += 1
+                    yield txt
+                    continue
+                t1 = time.perf_counter()
+                _, txt = futures[i].result() if i in futures else _ocr_page(i, file_bytes)
+                stats["ocr_seconds"] += time.perf_counter() - t1
+                stats["ocr_pages"] += 1
+                if txt is not None:
+                    yield txt
+    finally:
+        for pool in (text_pool, ocr_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    stats["text_pages_per_sec"] = stats["text_pages"] / stats["text_seconds"] if stats["text_seconds"] > 0 else 0.0
+    stats["ocr_pages_per_sec"] = stats["ocr_pages"] / stats["ocr_seconds"] if stats["ocr_seconds"] > 0 else 0.0
+    last_parse_stats = stats
+    print(
+        f"[document_parser] {n_pages} pages: {stats['text_pages']} text ({stats['text_pages_per_sec']:.1f} pages/sec), "
+        f"{stats['ocr_pages']} OCR ({stats['ocr_pages_per_sec']:.2f} pages/sec)"
+    )
+
+
+def parse_pdf(file_bytes: bytes, max_workers: int = None, max_ocr_workers: int = None) -> str:
+    return "\n".join(iter_pdf_pages(file_bytes, max_workers, max_ocr_workers))
 
 def parse_docx(file_bytes: bytes) -> str:
     # python-docx requires a path or file-like object
@@ -55,5 +186,57 @@ def parse_file(filename: str, file_bytes: bytes) -> str:
         # try as plain text
         try:
             return file_bytes.decode("utf-8")
-        except Exception:
-            return ""
+        except UnicodeDecodeError:
+            return file_bytes.decode("latin-1", errors="ignore")
+
+
+# ===========================================
+# 🗂 统一入口 + 按文件哈希缓存
+# ===========================================
+EXTRACT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "../data/extract_cache")
+EXTRACTOR_VERSION = "1"   # 抽取逻辑变化时改这个值，让旧缓存失效
+
+
+def _cache_path(filename: str, file_bytes: bytes) -> str:
+    ext = os.path.splitext(filename.lower())[1]
+    key = hashlib.sha256(f"{EXTRACTOR_VERSION}\0{ext}\0".encode("utf-8") + file_bytes).hexdigest()
+    return os.path.join(EXTRACT_CACHE_DIR, key + ".pages.jsonl")
+
+
+def extract_text(filename: str, file_bytes: bytes, use_cache: bool = True) -> str:
+    """按扩展名抽取文本；同一文件内容（+ 扩展名）只解析一次"""
+    with tracing.span("extract", file_type=os.path.splitext(filename.lower())[1], bytes=len(file_bytes)):
+        if not use_cache:
+            return parse_file(filename, file_bytes)
+        return "\n".join(iter_pages(filename, file_bytes))
+
+
+def iter_pages(filename: str, file_bytes: bytes) -> Iterator[str]:
+    """
+    流式版本的 extract_text：PDF 逐页 yield，其他格式一次 yield 全文。
+    缓存每行一页（JSON 字符串），命中时同样逐页 yield，不会把整本文档读成一个字符串；
+    未命中时边 yield 边把页写入缓存临时文件，全部结束后才替换成正式缓存（中途放弃不会留下残缺缓存）。
+    """
+    path = _cache_path(filename, file_bytes)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+        return
+    if os.path.splitext(filename.lower())[1] == ".pdf":
+        pages = iter_pdf_pages(file_bytes)
+    else:
+        pages = iter([parse_file(filename, file_bytes)])
+    os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{id(pages)}.tmp"
+    completed = False
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for page in pages:
+                f.write(json.dumps(page, ensure_ascii=False) + "\n")
+                yield page
+        os.replace(tmp, path)
+        completed = True
+    finally:
+        if not completed and os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,250 @@
+# backend/embed_cache.py
+"""
+按内容哈希缓存文档的分块结果与 embedding：
+同一份文件（同一 embedding 模型 + 分块参数）只需解析、向量化一次，
+之后的加载直接以 memory-map 方式读取 .npy，无需再调用 embedding 接口。
+另外提供 TextEmbeddingCache：按单条文本缓存 embedding（查询与 chunk 通用）。
+"""
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "../data/house_kb_cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+
+def content_key(file_bytes: bytes, *params) -> str:
+    """文件内容 + 影响结果的参数（模型名、chunk 大小等）共同决定缓存 key"""
+    h = hashlib.sha256()
+    for p in params:
+        h.update(str(p).encode("utf-8"))
+        h.update(b"\0")
+    h.update(file_bytes)
+    return h.hexdigest()
+
+
+def _paths(key: str):
+    base = os.path.join(CACHE_DIR, key)
+    return base + ".npy", base + ".chunks.json"
+
+
+def _offsets_path(key: str):
+    return os.path.join(CACHE_DIR, key + ".offsets.json")
+
+
+def load(key: str):
+    """命中返回 (chunks, embeddings)，embeddings 为只读 memmap；未命中返回 None"""
+    emb_path, chunks_path = _paths(key)
+    if not (os.path.exists(emb_path) and os.path.exists(chunks_path)):
+        return None
+    try:
+        with open(chunks_path, "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        embeddings = np.load(emb_path, mmap_mode="r")
+    except Exception as e:
+        print(f"[embed_cache] Ignoring unreadable cache entry {key}: {e}")
+        return None
+    if len(chunks) != len(embeddings):
+        return None
+    return chunks, embeddings
+
+
+def load_offsets(key: str):
+    """chunk 在原文中的起始位置（save 时传了 offsets 才有），没有则返回 None"""
+    try:
+        with open(_offsets_path(key), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save(key: str, chunks, embeddings, offsets=None):
+    writer = EntryWriter(key)
+    writer.append(chunks, embeddings)
+    writer.commit(offsets)
+
+
+COPY_ROWS = 4096   # commit 时从临时文件拷贝到 .npy 的每块行数
+
+
+class EntryWriter:
+    """
+    逐批写入一个缓存条目（流式摄取时每 embedding 完一批就 append 一批）：
+    向量先追加到临时的裸 float32 文件，commit 时再按块拷贝成 .npy，整篇文档的向量不会同时在内存里。
+    先写临时文件再替换，并发写同一个 key 时不会留下半截文件；出错时调用 abort 清理。
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks = []
+        self.dim = 0
+        self._suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        self._raw_path = _paths(key)[0] + self._suffix + ".raw"
+        self._raw = open(self._raw_path, "wb")
+
+    def append(self, chunks, embeddings):
+        emb = np.ascontiguousarray(embeddings, dtype="float32")
+        if len(emb):
+            self.dim = emb.shape[1]
+            self._raw.write(emb.tobytes())
+        self.chunks.extend(chunks)
+
+    def commit(self, offsets=None):
+        emb_path, chunks_path = _paths(self.key)
+        self._raw.close()
+        rows = len(self.chunks)
+        if rows and self.dim:
+            raw = np.memmap(self._raw_path, dtype="float32", mode="r", shape=(rows, self.dim))
+            out = np.lib.format.open_memmap(emb_path + self._suffix, mode="w+", dtype="float32", shape=(rows, self.dim))
+            for i in range(0, rows, COPY_ROWS):
+                out[i:i + COPY_ROWS] = raw[i:i + COPY_ROWS]
+            out.flush()
+            del out, raw
+        else:
+            with open(emb_path + self._suffix, "wb") as f:
+                np.save(f, np.zeros((rows, self.dim), dtype="float32"))
+        os.remove(self._raw_path)
+        with open(chunks_path + self._suffix, "w", encoding="utf-8") as f:
+            json.dump(self.chunks, f, ensure_ascii=False)
+        if offsets is not None:
+            with open(_offsets_path(self.key) + self._suffix, "w", encoding="utf-8") as f:
+                json.dump(list(offsets), f)
+            os.replace(_offsets_path(self.key) + self._suffix, _offsets_path(self.key))
+        os.replace(emb_path + self._suffix, emb_path)
+        os.replace(chunks_path + self._suffix, chunks_path)
+
+    def abort(self):
+        self._raw.close()
+        try:
+            os.remove(self._raw_path)
+        except OSError:
+            pass
+
+
+# ===========================================
+# 🔁 文本级 embedding 缓存（查询 + chunk）
+# ===========================================
+DISK_BUSY_TIMEOUT_MS = 10_000
+DISK_PRAGMAS = (   # 与 db.py 相同：多个 worker 进程同时读写时读不阻塞写、写锁被占用时等待
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={DISK_BUSY_TIMEOUT_MS}",
+)
+DISK_EVICT_SLACK = 0.1   # 超出上限这么多比例时才淘汰一次，不必每次写入都删
+
+
+class TextEmbeddingCache:
+    """
+    进程内 LRU（可选再加一层 SQLite 磁盘缓存），key = 模型名 + 规范化后的文本。
+    重复 / 只差大小写、空白的问题直接命中，跳过 embedding 请求。
+    max_disk_rows：磁盘缓存的条数上限，超出后按写入先后删掉最早的（None 为不限）。
+    """
+    def __init__(self, model: str, max_entries: int = 4096, disk_path: str = None, max_disk_rows: int = None):
+        self.model = model
+        self.max_entries = max_entries
+        self.max_disk_rows = max_disk_rows
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_rows = 0   # 估计值：REPLACE 已有 key 也会计入，淘汰时重新计数
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(disk_path, timeout=DISK_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+            for pragma in DISK_PRAGMAS:
+                self._db.execute(pragma)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB)")
+            self._db.commit()
+            self._disk_rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._evict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._avg_miss_seconds = 0.0   # 单条 embedding 的平均耗时，用来估算节省的延迟
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).casefold()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model}\0{self.normalize(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vec):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get_many(self, texts):
+        """返回 (vecs, missing)：vecs 与 texts 对齐，未命中处为 None；missing 为未命中的下标"""
+        vecs, missing = [], []
+        with self._lock:
+            for i, t in enumerate(texts):
+                key = self._key(t)
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    self.hits += 1
+                elif self._db is not None:
+                    row = self._db.execute("SELECT vec FROM embeddings WHERE key=?", (key,)).fetchone()
+                    if row:
+                        vec = np.frombuffer(row[0], dtype="float32")
+                        self._remember(key, vec)
+                        self.disk_hits += 1
+                if vec is None:
+                    self.misses += 1
+                    missing.append(i)
+                else:
+                    self.saved_seconds += self._avg_miss_seconds
+                vecs.append(vec)
+        return vecs, missing
+
+    def put_many(self, texts, vectors, elapsed: float = None):
+        """写入新算出的 embedding；elapsed 为这批 embedding 的耗时（用于统计）"""
+        with self._lock:
+            if elapsed is not None and len(texts):
+                per_text = elapsed / len(texts)
+                self._avg_miss_seconds = (
+                    per_text if self._avg_miss_seconds == 0 else 0.8 * self._avg_miss_seconds + 0.2 * per_text
+                )
+            rows = []
+            for t, v in zip(texts, vectors):
+                key = self._key(t)
+                vec = np.asarray(v, dtype="float32")
+                self._remember(key, vec)
+                rows.append((key, vec.tobytes()))
+            if self._db is not None and rows:
+                # INSERT OR REPLACE 会给重写的 key 一个新 rowid，rowid 的顺序即写入先后
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", rows)
+                self._db.commit()
+                self._disk_rows += len(rows)
+                if self.max_disk_rows and self._disk_rows > self.max_disk_rows * (1 + DISK_EVICT_SLACK):
+                    self._evict()
+
+    def _evict(self):
+        """磁盘缓存超过 max_disk_rows 时只保留最近写入的 max_disk_rows 条（调用方持有锁或在初始化中）"""
+        if not self.max_disk_rows or self._disk_rows <= self.max_disk_rows:
+            return
+        self._db.execute("""
+            DELETE FROM embeddings WHERE rowid <= (
+                SELECT rowid FROM embeddings ORDER BY rowid DESC LIMIT 1 OFFSET ?
+            )
+        """, (self.max_disk_rows,))
+        self._db.commit()
+        before = self._disk_rows
+        self._disk_rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        print(f"[embed_cache] Evicted ~{before - self._disk_rows} old disk entries (keeping {self._disk_rows})")
+
+    def stats(self) -> dict:
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
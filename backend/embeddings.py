@@ -1,7 +1,11 @@
 # backend/embeddings.py
-from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, HashingVectorizer
 from typing import List
 import gc
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
 
 # 🔥 全局单例：HashingVectorizer（内存固定，无需训练）
 _vectorizer = HashingVectorizer(
@@ -51,4 +55,108 @@ def clear_index():
     """清空索引（可选）"""
     global _texts
     _texts = []
-    gc.collect()
\ No newline at end of file
+    gc.collect()
+
+# ===========================================
+# 🔎 词法索引（BM25 over hashed terms，CSR 稀疏矩阵）
+# ===========================================
+# 与 dense 检索互补：条款号（4.2）、金额（S$7500）、单元号（#15-03）这类精确 token
+# 在 embedding 空间里区分度很低，BM25 可以直接命中。
+LEXICAL_FEATURES = 2 ** 20     # 哈希空间足够大，避免金额 / 编号之间碰撞
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 保留带 $ # . - / 的复合 token（S$7500、#15-03、4.2），同时拆出其中的字母数字部分
+_TOKEN_RE = re.compile(r"[\w$#](?:[\w$#.,\-/]*\w)?")
+_PART_RE = re.compile(r"\w+")
+
+
+def lexical_tokens(text: str) -> List[str]:
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        if tok.isalnum():
+            if tok not in ENGLISH_STOP_WORDS:
+                tokens.append(tok)
+            continue
+        tokens.append(tok)
+        tokens.extend(p for p in _PART_RE.findall(tok) if p not in ENGLISH_STOP_WORDS)
+    return tokens
+
+
+_lexical_vectorizer = HashingVectorizer(
+    n_features=LEXICAL_FEATURES,
+    analyzer=lexical_tokens,
+    alternate_sign=False,
+    norm=None,                 # 保留词频，BM25 自己做长度归一化
+)
+
+
+class LexicalIndex:
+    """对一组文本建 BM25 权重矩阵（CSR，行 = 文本位置）；查询 = 矩阵 × 查询词的 0/1 向量"""
+
+    def __init__(self, texts: List[str]):
+        tf = _lexical_vectorizer.transform(texts).tocsr().astype("float32")
+        n_docs = tf.shape[0]
+        doc_len = np.asarray(tf.sum(axis=1)).ravel()
+        avg_len = doc_len.mean() if n_docs and doc_len.mean() > 0 else 1.0
+        df = np.bincount(tf.indices, minlength=tf.shape[1])
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype("float32")
+        # 逐个非零元素算 BM25 词项权重，稀疏结构不变
+        row_len = np.repeat(doc_len, np.diff(tf.indptr))
+        denom = tf.data + BM25_K1 * (1 - BM25_B + BM25_B * row_len / avg_len)
+        tf.data = idf[tf.indices] * tf.data * (BM25_K1 + 1) / denom
+        self.matrix = tf
+        self.size = n_docs
+
+    def search(self, query: str, top_k: int = 8):
+        """返回 [(位置, BM25 分数)]，只包含至少命中一个词的文本"""
+        if self.size == 0:
+            return []
+        q = _lexical_vectorizer.transform([query])
+        q.data[:] = 1.0
+        scores = (self.matrix @ q.T).toarray().ravel()
+        hit = np.flatnonzero(scores > 0)
+        if len(hit) == 0:
+            return []
+        order = hit[np.argsort(-scores[hit])][:top_k]
+        return [(int(i), float(scores[i])) for i in order]
+
+
+LEXICAL_CACHE_SIZE = 64   # 最多缓存多少个分片的词法索引（LRU）；分片数随 house / 用户增长，不能无限缓存
+
+_lexical_cache = OrderedDict()    # key -> (version, 构建结果)，最近用过的在末尾
+_lexical_lock = threading.Lock()
+
+
+def lexical_index(key, version, build_fn):
+    """
+    按 (key, version) 缓存词法索引：version 不变（KB 没变）就复用，变了才调用 build_fn() 重建。
+    build_fn 返回要缓存的对象（如 (LexicalIndex, 对应的 metadata 列表)），原样返回给调用方。
+    超过 LEXICAL_CACHE_SIZE 个 key 时淘汰最久没用过的。
+    """
+    with _lexical_lock:
+        cached = _lexical_cache.get(key)
+        if cached is not None and cached[0] == version:
+            _lexical_cache.move_to_end(key)
+            return cached[1]
+    built = build_fn()
+    with _lexical_lock:
+        _lexical_cache[key] = (version, built)
+        _lexical_cache.move_to_end(key)
+        while len(_lexical_cache) > LEXICAL_CACHE_SIZE:
+            _lexical_cache.popitem(last=False)
+    return built
+
+
+def reciprocal_rank_fusion(rankings, weights, k: int = 60):
+    """
+    rankings: 多个按相关度排好序的 key 列表；weights: 每个列表的权重。
+    返回 [(key, 融合分数)]，分数 = Σ weight / (k + rank)
+    """
+    fused = {}
+    for ranking, w in zip(rankings, weights):
+        if w <= 0:
+            continue
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + w / (k + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
@@ -1,8 +1,9 @@
 # backend/house_kb.py
 import os
-from backend.db import get_conn
+import uuid
+from backend.db import connection, transaction
 from datetime import datetime
-from backend.rag_pipeline import add_document_from_file
+from backend import ingest_jobs
 
 HOUSE_UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "../data/house_kb")
 os.makedirs(HOUSE_UPLOAD_DIR, exist_ok=True)
@@ -11,17 +12,13 @@ os.makedirs(HOUSE_UPLOAD_DIR, exist_ok=True)
 # Create a house for landlord
 # ----------------------------
 def create_house(landlord_id, house_name, address):
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO houses (landlord_id, house_name, address, created_at)
-        VALUES (?, ?, ?, ?)
-    """, (landlord_id, house_name, address, datetime.utcnow().isoformat()))
-
-    hid = cur.lastrowid
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cur = conn.execute("""
+            INSERT INTO houses (landlord_id, house_name, address, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (landlord_id, house_name, address, datetime.utcnow().isoformat()))
+        hid = cur.lastrowid
+        _bump_kb_version(conn)
     return hid
 
 
@@ -29,14 +26,70 @@ def create_house(landlord_id, house_name, address):
 # List all houses belonging to a landlord
 # ----------------------------
 def list_houses(landlord_id):
-    conn = get_conn()
-    cur = conn.cursor()
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT * FROM houses WHERE landlord_id=? ORDER BY created_at DESC", (landlord_id,)
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def houses_with_doc_counts(landlord_id):
+    """房东的所有 house 及各自的 KB 文档数（doc_count），一条聚合查询代替 list_houses + 逐个 has_house_kb"""
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT h.*, COUNT(d.id) AS doc_count
+            FROM houses h LEFT JOIN house_documents d ON d.house_id = h.id
+            WHERE h.landlord_id=?
+            GROUP BY h.id
+            ORDER BY h.created_at DESC
+        """, (landlord_id,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+# ----------------------------
+# KB version counter
+# ----------------------------
+def kb_version():
+    """house / house KB 文档每次增删改都会 +1；页面按它判断缓存的 KB 概况是否需要重新查询"""
+    with connection() as conn:
+        row = conn.execute("SELECT version FROM kb_version WHERE id=1").fetchone()
+    return row["version"] if row else 0
 
-    cur.execute("SELECT * FROM houses WHERE landlord_id=? ORDER BY created_at DESC", (landlord_id,))
-    rows = [dict(r) for r in cur.fetchall()]
 
-    conn.close()
-    return rows
+def _bump_kb_version(conn):
+    """在做变更的同一个事务里调用"""
+    conn.execute("UPDATE kb_version SET version = version + 1 WHERE id=1")
+
+
+def _rag():
+    """RAG 流水线（FAISS / embedding 等）只在索引、删除文档时才导入，登录页用到本模块时不加载"""
+    from backend import rag_pipeline
+    return rag_pipeline
+
+
+def _house_doc_id(house_id, file_path):
+    """house KB 文档在向量索引中的 doc_id（由 house + 存储文件名唯一确定）"""
+    return f"house{house_id}/{os.path.basename(file_path)}"
+
+
+def _index_house_file(house_id, file_path, doc_id=None, on_embedding=None):
+    """
+    把一个 house KB 文件写入向量索引。
+    按文件内容哈希查 embedding 缓存（data/house_kb_cache），
+    同一份文件只在第一次（通常是上传时）解析和 embedding。
+    doc_id 已存在时（同名文件的新版本）只 embedding 改动过的 chunk。
+    on_embedding 见 rag_pipeline.add_document_from_file。
+    """
+    doc_id = doc_id or _house_doc_id(house_id, file_path)
+    with open(file_path, "rb") as f:
+        file_bytes = f.read()
+    rag = _rag()
+    cache_key = rag.document_cache_key(file_bytes)
+    # 按扩展名交给统一抽取服务（pdf / docx / 图片 / 纯文本），不再把所有非 PDF 当 UTF-8 读
+    file_type = os.path.splitext(file_path)[1].lstrip(".").lower() or "txt"
+    rag.add_document_from_file(file_bytes, file_type=file_type, doc_id=doc_id, house_id=house_id, cache_key=cache_key,
+                               on_embedding=on_embedding)
+    return doc_id
 
 
 # ----------------------------
@@ -45,92 +98,130 @@ def list_houses(landlord_id):
 def upload_house_document(house_id, file_bytes, filename):
     """
     1. 把房东上传的 KB 文件存到磁盘
-    2. 写入 house_documents 表
-    3. 同时送进 RAG（调用 add_document_from_file 更新 VEC_STORE）
+    2. 放进后台摄取队列（ingest_jobs），立即返回任务 id，页面不用等解析 + embedding
+    同一 house 已有内容相同的任务（排队中 / 进行中 / 已完成）时不重复保存，直接返回该任务 id。
     """
-    safe_name = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{filename}"
+    file_hash = ingest_jobs.content_hash(file_bytes)
+    existing = ingest_jobs.find_duplicate(house_id, file_hash)
+    if existing is not None:
+        print(f"[house_kb] Duplicate upload for house {house_id}, reusing job {existing}")
+        return existing
+
+    # 时间戳只到秒，同一秒内上传同名（内容不同）的文件会互相覆盖，再加一段随机后缀
+    safe_name = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}_{filename}"
     save_path = os.path.join(HOUSE_UPLOAD_DIR, safe_name)
 
     # 1️⃣ 保存文件到本地
     with open(save_path, "wb") as f:
         f.write(file_bytes)
 
-    # 2️⃣ 同步到 RAG（关键的一步）
-    lower = filename.lower()
-    try:
-        if lower.endswith(".pdf"):
-            # 用二进制方式重新打开，让 rag_pipeline 自己抽取文本
-            with open(save_path, "rb") as f:
-                add_document_from_file(f, file_type="pdf")
-        else:
-            # 其他当作文本
-            with open(save_path, "r", encoding="utf-8", errors="ignore") as f:
-                text = f.read()
-            add_document_from_file(text, file_type="txt")
+    # 2️⃣ 入队，由后台 worker 写入 RAG 和 house_documents
+    return ingest_jobs.enqueue(house_id, save_path, filename, file_hash)
 
-        print(f"[house_kb] Indexed house document into RAG: {save_path}")
-    except Exception as e:
-        print(f"[house_kb] Error indexing house document into RAG: {e}")
 
-    # 3️⃣ 写入 house_documents 表（用于 UI 展示“已有 KB”）
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO house_documents (house_id, file_path, uploaded_at)
-        VALUES (?, ?, ?)
-    """, (house_id, save_path, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
+def _previous_version(house_id, filename):
+    """同一 house 中同名文件（存储名为 <时间戳>-<随机后缀>_<filename>，前缀里没有下划线）的已有记录，没有则返回 None"""
+    if not filename:
+        return None
+    for d in get_house_docs(house_id):
+        stored = os.path.basename(d["file_path"])
+        if stored.split("_", 1)[-1] == filename:
+            return d
+    return None
 
-    return save_path
+
+def index_and_record(house_id, file_path, filename=None, on_embedding=None):
+    """
+    （由摄取 worker 调用）把文件写入该 house 的索引分片，
+    再写入 house_documents 表（用于 UI 展示“已有 KB”），返回记录 id。
+    同名文件重新上传视为新版本：沿用旧的 rag_doc_id 增量更新索引，并更新原记录。
+    on_embedding：解析完第一批 chunk、开始 embedding 时调用（摄取任务用来更新状态）。
+    """
+    prev = _previous_version(house_id, filename)
+    rag_doc_id = _index_house_file(
+        house_id, file_path, doc_id=prev["rag_doc_id"] if prev else None, on_embedding=on_embedding
+    )
+    print(f"[house_kb] Indexed house document into RAG: {file_path}")
+    # KB 变了：该 house 的缓存答案作废
+    rag = _rag()
+    rag.answer_cache.invalidate(rag.house_namespace(house_id))
+
+    with transaction() as conn:
+        if prev and prev["rag_doc_id"]:
+            conn.execute(
+                "UPDATE house_documents SET file_path=?, uploaded_at=? WHERE id=?",
+                (file_path, datetime.utcnow().isoformat(), prev["id"]),
+            )
+            row_id = prev["id"]
+            # 旧版本的 done 任务已不再对应索引里的内容：去掉，之后重新上传旧版本时会重新入队，而不是被当成重复
+            ingest_jobs.forget_document(row_id, conn)
+        else:
+            cur = conn.execute("""
+                INSERT INTO house_documents (house_id, file_path, rag_doc_id, uploaded_at)
+                VALUES (?, ?, ?, ?)
+            """, (house_id, file_path, rag_doc_id, datetime.utcnow().isoformat()))
+            row_id = cur.lastrowid
+        _bump_kb_version(conn)
+    return row_id
 
 
 # ----------------------------
 # Retrieve ALL documents in a house KB
 # ----------------------------
 def get_house_docs(house_id):
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("SELECT * FROM house_documents WHERE house_id=?", (house_id,))
-    rows = [dict(r) for r in cur.fetchall()]
-
-    conn.close()
-    return rows
+    with connection() as conn:
+        rows = conn.execute("SELECT * FROM house_documents WHERE house_id=?", (house_id,)).fetchall()
+    return [dict(r) for r in rows]
 
 def has_house_kb(house_id):
     """Return True if the house has at least one KB document."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM house_documents WHERE house_id=?", (house_id,))
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute("SELECT COUNT(*) AS c FROM house_documents WHERE house_id=?", (house_id,)).fetchone()
     return row["c"] > 0
 
 
+def delete_house_document(doc_row_id):
+    """删除一份 house KB 文档：移出向量索引、删除数据库记录（文件保留在磁盘）"""
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT house_id, file_path, rag_doc_id FROM house_documents WHERE id=?", (doc_row_id,)
+        ).fetchone()
+    if not row:
+        return False
+    rag = _rag()
+    rag.get_store(rag.house_namespace(row["house_id"])).delete_document(
+        row["rag_doc_id"] or _house_doc_id(row["house_id"], row["file_path"])
+    )
+    rag.answer_cache.invalidate(rag.house_namespace(row["house_id"]))
+    with transaction() as conn:
+        conn.execute("DELETE FROM house_documents WHERE id=?", (doc_row_id,))
+        _bump_kb_version(conn)
+    ingest_jobs.forget_document(doc_row_id)
+    return True
+
+
 def load_house_kb_into_rag(house_id):
     """
-    从数据库中读取 house 所有文件，然后自动构建向量库（VEC_STORE）
-    在用户登录或进入 Chat 页面时调用
+    确保 house 的所有文件都在该 house 自己的索引分片中。
+    在用户登录或进入 Chat 页面时调用；已索引的文档直接跳过，不会重新 embedding。
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT file_path FROM house_documents WHERE house_id=?", (house_id,))
-    files = [r["file_path"] for r in cur.fetchall()]
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT file_path, rag_doc_id FROM house_documents WHERE house_id=?", (house_id,)
+        ).fetchall()
 
-    if not files:
+    if not rows:
         return False, "No KB files found."
 
-    for fpath in files:
+    rag = _rag()
+    store = rag.get_store(rag.house_namespace(house_id))
+    for r in rows:
+        fpath = r["file_path"]
+        doc_id = r["rag_doc_id"] or _house_doc_id(house_id, fpath)
+        if store.has_document(doc_id):
+            continue
         try:
-            lower = fpath.lower()
-            if lower.endswith(".pdf"):
-                with open(fpath, "rb") as f:
-                    add_document_from_file(f, file_type="pdf")
-            else:
-                with open(fpath, "r", encoding="utf-8", errors="ignore") as f:
-                    add_document_from_file(f.read(), file_type="txt")
+            _index_house_file(house_id, fpath)
         except Exception as e:
             print("[load_house_kb_into_rag] error:", e)
 
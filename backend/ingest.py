@@ -0,0 +1,234 @@
+# backend/ingest.py
+"""
+Embedding 摄取流水线：
+按 token 预算把 chunk 切成多个批次 → 有限并发地发送 → 单个批次失败只重试该批次，
+最后按原顺序拼回一个矩阵，并报告吞吐量（chunks/sec）。
+OpenAI 与本地 SentenceTransformer 两种后端共用这套逻辑，只是批次参数不同。
+"""
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Tuple
+import numpy as np
+from backend import tracing
+
+# 全项目唯一的 token 计数（embedding 批次预算、context 预算、prompt / completion 统计都用它）：
+# 按 CHAT_MODEL（gpt-4o，o200k）的编码计；text-embedding-3 的 cl100k 与之相差很小，批次预算留足了余量
+TOKENIZER_MODEL = "gpt-4o"
+
+# 最近一次 embed_in_batches 的统计（chunks / batches / seconds / chunks_per_sec / retries）
+last_stats = {}
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    tiktoken 编码，第一次计数时才导入 / 加载（冷缓存时 tiktoken 要下载词表，不放在 import 阶段）；
+    没装 tiktoken 或加载失败时返回 None，调用方按字符数估算
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+                except Exception as e:   # tiktoken 可选
+                    print(f"[ingest] tiktoken unavailable ({type(e).__name__}); estimating tokens from length")
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    enc = get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1   # 英文约 4 字符 / token
+
+
+def make_batches(texts: List[str], max_tokens: int, max_items: int) -> List[Tuple[int, int]]:
+    """返回 [(start, end), ...]，每批 token 总数不超过 max_tokens、条数不超过 max_items"""
+    batches = []
+    start, budget = 0, 0
+    for i, t in enumerate(texts):
+        n = count_tokens(t)
+        if i > start and (budget + n > max_tokens or i - start >= max_items):
+            batches.append((start, i))
+            start, budget = i, 0
+        budget += n
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def _run_with_retry(embed_batch: Callable, texts: List[str], max_retries: int, backoff: float):
+    retries = 0
+    while True:
+        try:
+            return np.asarray(embed_batch(texts), dtype="float32"), retries
+        except Exception as e:
+            if retries >= max_retries:
+                raise
+            retries += 1
+            wait = backoff * (2 ** (retries - 1))
+            print(f"[ingest] Batch of {len(texts)} failed ({e}); retry {retries}/{max_retries} in {wait:.1f}s")
+            time.sleep(wait)
+
+
+def embed_in_batches(texts: List[str], embed_batch: Callable, max_tokens: int = 100_000,
+                     max_items: int = 2048, max_workers: int = 4, max_retries: int = 2,
+                     backoff: float = 1.0) -> np.ndarray:
+    """
+    embed_batch: 单次请求的 embedding 函数（list[str] -> 矩阵）
+    返回与 texts 顺序一致的 float32 矩阵。
+    """
+    global last_stats
+    if not texts:
+        return np.zeros((0, 0), dtype="float32")
+    t0 = time.perf_counter()
+    batches = make_batches(texts, max_tokens, max_items)
+
+    if len(batches) == 1 or max_workers <= 1:
+        outputs = [_run_with_retry(embed_batch, texts[s:e], max_retries, backoff) for s, e in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+            futures = [
+                pool.submit(_run_with_retry, embed_batch, texts[s:e], max_retries, backoff)
+                for s, e in batches
+            ]
+            outputs = [f.result() for f in futures]
+
+    result = np.vstack([emb for emb, _ in outputs])
+    elapsed = time.perf_counter() - t0
+    last_stats = {
+        "chunks": len(texts),
+        "batches": len(batches),
+        "seconds": elapsed,
+        "chunks_per_sec": len(texts) / elapsed if elapsed > 0 else float("inf"),
+        "retries": sum(r for _, r in outputs),
+    }
+    if len(texts) > 1:
+        print(
+            f"[ingest] Embedded {len(texts)} chunks in {len(batches)} batches, "
+            f"{elapsed:.2f}s ({last_stats['chunks_per_sec']:.1f} chunks/sec)"
+        )
+    return result
+
+
+# ===========================================
+# 🌊 流式流水线：页 → chunk → embedding 批次
+# ===========================================
+def iter_chunks(pages: Iterable[str], splitter, sep: str = "\n", offsets: list = None) -> Iterator[str]:
+    """
+    逐页分块，不拼接整本文档：每页与上一页留下的“尾巴”（最后一个可能未满的 chunk）
+    拼在一起再切分，除最后一个 chunk 外全部输出，最后一个带到下一页。
+    这样跨页的 chunk 与 chunk overlap 和整篇切分时一致，内存只与单页 + 一个 chunk 有关。
+    切分耗时分散在每一页上，结束时累加后记为一个 "chunk" span。
+    offsets: 传入列表时，按产出顺序追加每个 chunk 在全文（各页以 sep 拼接）中的起始字符位置，
+    检索后据此合并相邻 / 重叠的 chunk（见 context_builder）。
+    """
+    carry, carry_start = "", 0
+    doc_len = 0                 # 目前为止全文的长度
+    split_seconds, n = 0.0, 0
+    for page in pages:
+        if not page:
+            continue
+        page_start = doc_len + len(sep) if doc_len else 0
+        doc_len = page_start + len(page)
+        prefix = carry + sep if carry else ""
+        buf = prefix + page
+        t0 = time.perf_counter()
+        chunks = splitter.split_text(buf)
+        split_seconds += time.perf_counter() - t0
+        if not chunks:
+            continue
+        starts, cursor = [], 0
+        for c in chunks:
+            # chunk 是 buf 的子串（只去掉首尾空白），按顺序往后找；落在 carry 部分的按 carry 的位置换算
+            p = buf.find(c, cursor)
+            if p < 0:
+                p = cursor
+            cursor = p + 1
+            starts.append(carry_start + p if p < len(prefix) else page_start + p - len(prefix))
+        if offsets is not None:
+            offsets.extend(starts[:-1])
+        n += len(chunks) - 1
+        yield from chunks[:-1]
+        carry, carry_start = chunks[-1], starts[-1]
+    if carry:
+        if offsets is not None:
+            offsets.append(carry_start)
+        n += 1
+        yield carry
+    tracing.record("chunk", split_seconds, chunks=n)
+
+
+def iter_batches(chunks: Iterable[str], max_tokens: int, max_items: int) -> Iterator[List[str]]:
+    """按 token 预算 / 条数上限把 chunk 流切成批次（与 make_batches 规则一致）"""
+    batch, budget = [], 0
+    for c in chunks:
+        n = count_tokens(c)
+        if batch and (budget + n > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch, budget = [], 0
+        batch.append(c)
+        budget += n
+    if batch:
+        yield batch
+
+
+def embed_stream(chunks: Iterable[str], embed_batch: Callable, max_tokens: int = 100_000,
+                 max_items: int = 2048, max_workers: int = 4, max_retries: int = 2,
+                 backoff: float = 1.0, on_start: Callable = None) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """
+    边消费 chunk 流边提交 embedding 批次：抽取 / 分块在当前线程继续进行，
+    同时最多 max_workers 个批次在线程池里 embedding，第一批凑满就开始发请求。
+    按输入顺序逐批 yield (batch_chunks, embeddings)：调用方拿到一批就写入索引 / 缓存，
+    内存里只有在途的批次，不会把整篇文档的向量攒在一起。
+    on_start：提交第一批之前调用一次（如摄取任务从 parsing 切到 embedding）。
+    整个流消费完后才更新 last_stats。
+    """
+    global last_stats
+    t0 = time.perf_counter()
+    n_chunks, n_batches, retries = 0, 0, 0
+    in_flight = deque()   # (batch, future)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for batch in iter_batches(chunks, max_tokens, max_items):
+            if on_start is not None and not n_chunks:
+                on_start()
+            n_chunks += len(batch)
+            # 在调用方的 context 里执行：批次内的 tracing span 挂在当前的 ingest span 下
+            ctx = contextvars.copy_context()
+            in_flight.append((batch, pool.submit(ctx.run, _run_with_retry, embed_batch, batch, max_retries, backoff)))
+            # 在途批次达到上限时先交出最早的一批，限制并发和在途向量的数量
+            while len(in_flight) >= max_workers:
+                done, fut = in_flight.popleft()
+                emb, r = fut.result()
+                retries += r
+                n_batches += 1
+                yield done, emb
+        while in_flight:
+            done, fut = in_flight.popleft()
+            emb, r = fut.result()
+            retries += r
+            n_batches += 1
+            yield done, emb
+
+    elapsed = time.perf_counter() - t0
+    last_stats = {
+        "chunks": n_chunks,
+        "batches": n_batches,
+        "seconds": elapsed,
+        "chunks_per_sec": n_chunks / elapsed if elapsed > 0 else float("inf"),
+        "retries": retries,
+    }
+    print(
+        f"[ingest] Streamed {n_chunks} chunks in {n_batches} batches, "
+        f"{elapsed:.2f}s ({last_stats['chunks_per_sec']:.1f} chunks/sec)"
+    )
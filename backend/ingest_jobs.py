@@ -0,0 +1,195 @@
+# backend/ingest_jobs.py
+"""
+house KB 上传的后台摄取队列（持久化在现有 SQLite 的 ingest_jobs 表里）：
+上传只负责存文件 + 入队，后台 worker 线程领取任务（parsing）→ 逐页解析并 embedding 写索引（embedding）
+→ 写 house_documents（done）。失败按指数退避重试，超过 MAX_ATTEMPTS 后标记 failed 并保留错误信息。
+同一 house 下内容哈希相同、且未失败的任务只保留一个（重复上传直接返回已有任务）。
+"""
+import os
+import hashlib
+import threading
+import traceback
+from datetime import datetime, timedelta
+from backend.db import connection, transaction
+
+INGEST_WORKERS = int(os.environ.get("RENTBOT_INGEST_WORKERS", "2"))
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 30      # 第 n 次重试前等待 RETRY_BACKOFF_SECONDS * 2^(n-1)
+POLL_SECONDS = 2.0              # 没有新任务通知时的轮询间隔（其他进程入队的任务靠轮询发现）
+STALE_SECONDS = 30 * 60         # 启动时把超过这么久仍在 parsing/embedding 的任务视为 worker 已退出，重新排队
+
+JOB_STATUSES = ("queued", "parsing", "embedding", "done", "failed")
+ACTIVE_STATUSES = ("queued", "parsing", "embedding")
+
+_wakeup = threading.Event()
+_threads = []
+_start_lock = threading.Lock()
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def content_hash(file_bytes: bytes) -> str:
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+# ===========================================
+# 📥 入队 / 查询
+# ===========================================
+def find_duplicate(house_id, file_hash):
+    """同一 house 中内容相同、且未失败的任务 id；没有则返回 None"""
+    with connection() as conn:
+        row = conn.execute("""
+            SELECT id FROM ingest_jobs
+            WHERE house_id=? AND content_hash=? AND status != 'failed'
+            ORDER BY id DESC LIMIT 1
+        """, (house_id, file_hash)).fetchone()
+    return row["id"] if row else None
+
+
+def enqueue(house_id, file_path, filename, file_hash):
+    """新建一个 queued 任务并唤醒 worker，返回任务 id"""
+    now = _now()
+    with transaction() as conn:
+        cur = conn.execute("""
+            INSERT INTO ingest_jobs (house_id, filename, file_path, content_hash, status, next_run_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)
+        """, (house_id, filename, file_path, file_hash, now, now, now))
+        job_id = cur.lastrowid
+    _wakeup.set()
+    return job_id
+
+
+def list_jobs(house_id, limit=20):
+    """某个 house 最近的摄取任务（最新的在前），用于房东面板展示"""
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT * FROM ingest_jobs WHERE house_id=? ORDER BY id DESC LIMIT ?", (house_id, limit)
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def retry_job(job_id):
+    """把 failed 的任务重新排队（重置尝试次数）"""
+    with transaction() as conn:
+        cur = conn.execute("""
+            UPDATE ingest_jobs SET status='queued', attempts=0, error=NULL, next_run_at=?, updated_at=?
+            WHERE id=? AND status='failed'
+        """, (_now(), _now(), job_id))
+        ok = cur.rowcount == 1
+    if ok:
+        _wakeup.set()
+    return ok
+
+
+def forget_document(doc_row_id, conn=None):
+    """
+    house_documents 记录被删除、或被同名文件的新版本替换后，去掉对应的 done 任务，
+    之后可以重新上传同一份文件（包括回退到旧版本）。传入 conn 时在调用方的事务里执行。
+    """
+    if conn is not None:
+        conn.execute("DELETE FROM ingest_jobs WHERE doc_row_id=?", (doc_row_id,))
+        return
+    with transaction() as conn:
+        conn.execute("DELETE FROM ingest_jobs WHERE doc_row_id=?", (doc_row_id,))
+
+
+# ===========================================
+# ⚙️ Worker
+# ===========================================
+def _set_status(job_id, status, **fields):
+    cols = ", ".join(f"{k}=?" for k in fields)
+    with transaction() as conn:
+        conn.execute(
+            f"UPDATE ingest_jobs SET status=?, updated_at=?{', ' + cols if cols else ''} WHERE id=?",
+            (status, _now(), *fields.values(), job_id),
+        )
+
+
+def _claim():
+    """领取一个到期的 queued 任务；在同一个写事务里查找并改状态，多个线程 / 进程不会领到同一个"""
+    now = _now()
+    with transaction() as conn:
+        row = conn.execute("""
+            SELECT id FROM ingest_jobs
+            WHERE status='queued' AND next_run_at <= ?
+            ORDER BY id LIMIT 1
+        """, (now,)).fetchone()
+        if not row:
+            return None
+        conn.execute("""
+            UPDATE ingest_jobs SET status='parsing', attempts=attempts+1, updated_at=?
+            WHERE id=?
+        """, (now, row["id"]))
+        return dict(conn.execute("SELECT * FROM ingest_jobs WHERE id=?", (row["id"],)).fetchone())
+
+
+def _run(job):
+    from backend import house_kb   # house_kb 入队时会 import 本模块，这里延迟导入避免循环
+
+    job_id = job["id"]
+    try:
+        # 解析和 embedding 在 add_document_from_file 里按页流式进行，不先整篇抽取：
+        # _claim 已置为 parsing，第一批 chunk 提交 embedding 时再切到 embedding。
+        # 文件丢失（FileNotFoundError）/ 抽不出文字（ValueError）都由它抛出
+        doc_row_id = house_kb.index_and_record(
+            job["house_id"], job["file_path"], job["filename"],
+            on_embedding=lambda: _set_status(job_id, "embedding"),
+        )
+        _set_status(job_id, "done", doc_row_id=doc_row_id, error=None)
+        print(f"[ingest_jobs] Job {job_id} done: {job['file_path']}")
+    except Exception as e:
+        err = f"{type(e).__name__}: {e}"
+        # 文件丢失 / 抽不出文字重试也没用，直接失败
+        permanent = isinstance(e, (ValueError, FileNotFoundError))
+        if permanent or job["attempts"] >= MAX_ATTEMPTS:
+            _set_status(job_id, "failed", error=err)
+            print(f"[ingest_jobs] Job {job_id} failed after {job['attempts']} attempt(s): {err}")
+            traceback.print_exc()
+        else:
+            wait = RETRY_BACKOFF_SECONDS * (2 ** (job["attempts"] - 1))
+            next_run = (datetime.utcnow() + timedelta(seconds=wait)).isoformat()
+            _set_status(job_id, "queued", error=err, next_run_at=next_run)
+            print(f"[ingest_jobs] Job {job_id} attempt {job['attempts']}/{MAX_ATTEMPTS} failed ({err}); retry in {wait}s")
+
+
+def _worker_loop():
+    while True:
+        try:
+            job = _claim()
+        except Exception as e:   # 数据库暂时被锁等情况：稍后再试
+            print(f"[ingest_jobs] Claim error: {e}")
+            job = None
+        if job is None:
+            _wakeup.wait(POLL_SECONDS)
+            _wakeup.clear()
+            continue
+        try:
+            _run(job)
+        except Exception as e:   # 更新任务状态本身失败；任务会在 STALE_SECONDS 后被重新排队
+            print(f"[ingest_jobs] Worker error on job {job['id']}: {e}")
+
+
+def _requeue_stale():
+    cutoff = (datetime.utcnow() - timedelta(seconds=STALE_SECONDS)).isoformat()
+    with transaction() as conn:
+        cur = conn.execute("""
+            UPDATE ingest_jobs SET status='queued', next_run_at=?, updated_at=?
+            WHERE status IN ('parsing', 'embedding') AND updated_at < ?
+        """, (_now(), _now(), cutoff))
+    if cur.rowcount:
+        print(f"[ingest_jobs] Re-queued {cur.rowcount} stale job(s)")
+
+
+def start_workers(n=None):
+    """启动后台 worker 线程（daemon）；同一进程内重复调用不会多开"""
+    with _start_lock:
+        if _threads:
+            return
+        _requeue_stale()
+        for i in range(n or INGEST_WORKERS):
+            t = threading.Thread(target=_worker_loop, name=f"ingest-worker-{i}", daemon=True)
+            t.start()
+            _threads.append(t)
+        print(f"[ingest_jobs] Started {len(_threads)} ingest worker(s)")
@@ -0,0 +1,78 @@
+# backend/llm_client.py
+"""
+进程级共享的 OpenAI client：
+所有模块通过 get_client() 拿到同一个实例，底层 httpx 连接池保持 keep-alive，
+每次提问不再重新建立 TCP / TLS 连接。超时、重试（SDK 自带指数退避）和
+base_url 都可以通过环境变量或 configure() 调整，测试时可指向本地的替身服务。
+"""
+import os
+import threading
+import httpx
+from openai import OpenAI
+
+# ===========================================
+# 🔧 可配置参数（环境变量优先）
+# ===========================================
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL")          # None 则使用官方地址
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "3"))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# ===========================================
+
+_client = None
+_overrides = {}
+_lock = threading.Lock()
+
+
+def _api_key():
+    key = _overrides.get("api_key") or os.environ.get("OPENAI_API_KEY")
+    if key:
+        return key
+    import streamlit as st
+    return st.secrets["OPENAI_API_KEY"]
+
+
+def _build_client() -> OpenAI:
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(_overrides.get("timeout", OPENAI_TIMEOUT), connect=OPENAI_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    )
+    return OpenAI(
+        api_key=_api_key(),
+        base_url=_overrides.get("base_url", OPENAI_BASE_URL),
+        max_retries=_overrides.get("max_retries", OPENAI_MAX_RETRIES),
+        http_client=http_client,
+    )
+
+
+def get_client() -> OpenAI:
+    """返回进程内共享的 client（线程安全，首次调用时创建）"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def configure(base_url=None, api_key=None, timeout=None, max_retries=None):
+    """
+    覆盖默认配置并丢弃当前 client，下次 get_client() 按新配置重建。
+    例如测试时：configure(base_url="http://127.0.0.1:8001/v1", api_key="test")
+    """
+    global _client
+    with _lock:
+        for k, v in (("base_url", base_url), ("api_key", api_key),
+                     ("timeout", timeout), ("max_retries", max_retries)):
+            if v is not None:
+                _overrides[k] = v
+        if _client is not None:
+            _client.close()
+        _client = None
@@ -0,0 +1,213 @@
+# backend/local_embedder.py
+"""
+本地 CPU embedding 引擎：直接从 models/ 下随仓库提供的模型目录加载（默认不按名字联网下载），
+可选 OpenVINO / ONNX 的 fp32 或 int8 量化版本，并把并发的小请求合并成一个批次（dynamic batching）。
+
+    python -m backend.local_embedder            # 各后端吞吐量 + 与 fp32 torch 的检索一致性
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List
+import numpy as np
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "../models/sentence-transformers_all-MiniLM-L6-v2")
+HUB_MODEL_NAME = "all-MiniLM-L6-v2"     # 本地目录缺少权重时按名字下载（需要联网），默认关闭
+ALLOW_HUB_DOWNLOAD = os.environ.get("RENTBOT_EMBED_ALLOW_DOWNLOAD", "0") == "1"
+
+# backend 名 -> (sentence-transformers 的 backend 参数, 模型目录下的文件)
+# onnx / openvino 需要安装 optimum（optimum[onnxruntime] / optimum[openvino]）
+BACKENDS = {
+    "torch": ("torch", None),
+    "onnx": ("onnx", "onnx/model.onnx"),
+    "onnx-int8": ("onnx", "onnx/model_quint8_avx2.onnx"),
+    "openvino": ("openvino", "openvino/openvino_model.xml"),
+    "openvino-int8": ("openvino", "openvino/openvino_model_qint8_quantized.xml"),
+}
+
+
+def resolve_backend(backend: str = "openvino-int8", model_dir: str = MODEL_DIR) -> str:
+    """
+    不加载模型，只看文件和依赖，判断实际会用哪个后端：所选变体的文件存在且装了 optimum 时就是它，
+    否则退回 fp32 "torch"。不同后端的向量不完全相同，调用方应把结果放进索引 / 缓存的 key。
+    """
+    from importlib.util import find_spec
+
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {tuple(BACKENDS)}")
+    st_backend, file_name = BACKENDS[backend]
+    if file_name is None:
+        return backend
+    if os.path.exists(os.path.join(model_dir, file_name)) and find_spec("optimum") is not None:
+        return backend
+    print(f"[local_embedder] {backend} is not available ({file_name} or optimum missing); using torch (fp32)")
+    return "torch"
+
+
+def load_model(backend: str = "openvino-int8", model_dir: str = MODEL_DIR,
+               fallback: bool = True, allow_hub: bool = ALLOW_HUB_DOWNLOAD):
+    """
+    按 backend 加载 SentenceTransformer（始终在 CPU 上）。
+    所选变体不可用（文件缺失 / 没装 optimum）时：fallback=True 退回本地 fp32 torch，否则直接报错。
+    只有 allow_hub=True（RENTBOT_EMBED_ALLOW_DOWNLOAD=1）时才会最后按名字从 hub 下载 fp32 模型。
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {tuple(BACKENDS)}")
+    st_backend, file_name = BACKENDS[backend]
+    attempts = []
+    if os.path.isdir(model_dir):
+        if file_name is not None:
+            attempts.append((backend, model_dir, {"backend": st_backend, "model_kwargs": {"file_name": file_name}}))
+        if file_name is None or fallback:
+            attempts.append(("torch", model_dir, {}))
+    if allow_hub and (file_name is None or fallback):
+        attempts.append(("torch", HUB_MODEL_NAME, {}))
+
+    last_error = None
+    for name, path, kwargs in attempts:
+        try:
+            model = SentenceTransformer(path, device="cpu", **kwargs)
+            print(f"[local_embedder] Loaded {path} ({name})")
+            return model, name
+        except Exception as e:
+            last_error = e
+            print(f"[local_embedder] Could not load {path} ({name}): {e}")
+    raise RuntimeError(
+        f"No local embedding model could be loaded for backend {backend!r} from {model_dir}: {last_error} "
+        "(set RENTBOT_EMBED_ALLOW_DOWNLOAD=1 to allow downloading the fp32 model from the hub)"
+    )
+
+
+class LocalEmbedder:
+    """
+    encode() 可被多个线程同时调用：请求进入队列，后台线程把等待时间 ≤ max_wait_ms 内到达的请求
+    合并成一次 model.encode（最多 max_batch 条一批），再把结果按请求拆回去。
+    单条查询的延迟几乎不变，并发 / 批量摄取时吞吐量接近整批推理。
+    """
+    def __init__(self, backend: str = "openvino-int8", model_dir: str = MODEL_DIR,
+                 max_batch: int = 64, max_wait_ms: float = 5.0, fallback: bool = True):
+        self.model, self.backend = load_model(backend, model_dir, fallback=fallback)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._requests = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _encode_now(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts, batch_size=self.max_batch, convert_to_numpy=True, normalize_embeddings=True
+        ).astype("float32")
+
+    def _loop(self):
+        while True:
+            pending = [self._requests.get()]
+            size = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    req = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(req)
+                size += len(req[0])
+            texts = [t for req_texts, _ in pending for t in req_texts]
+            try:
+                vecs = self._encode_now(texts)
+            except Exception as e:
+                for _, fut in pending:
+                    fut.set_exception(e)
+                continue
+            start = 0
+            for req_texts, fut in pending:
+                fut.set_result(vecs[start:start + len(req_texts)])
+                start += len(req_texts)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype="float32")
+        # 大请求（摄取时的整批 chunk）本身已经是满批，直接推理
+        if len(texts) >= self.max_batch:
+            return self._encode_now(texts)
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="local-embedder", daemon=True)
+                self._thread.start()
+        fut = Future()
+        self._requests.put((texts, fut))
+        return fut.result()
+
+    @property
+    def dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+
+# ===========================================
+# 📊 吞吐量 + 检索一致性评测
+# ===========================================
+def benchmark(corpus: List[str], queries: List[str], backends=None, top_k: int = 5,
+              model_dir: str = MODEL_DIR) -> Dict[str, dict]:
+    """
+    每个后端对 corpus 做 embedding，报告 texts/sec；
+    以 fp32 torch 为基准，报告向量余弦相似度（均值 / 最小值）和查询 top_k 近邻的重合率。
+    """
+    backends = backends or list(BACKENDS)
+    results, reference = {}, None
+    for name in ["torch"] + [b for b in backends if b != "torch"]:
+        try:
+            embedder = LocalEmbedder(name, model_dir)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+            continue
+        if embedder.backend != name:   # 退回到了其他后端，结果没有意义
+            results[name] = {"error": f"fell back to {embedder.backend}"}
+            continue
+        embedder.encode(corpus[:8])    # 预热
+        t0 = time.perf_counter()
+        doc_vecs = embedder.encode(corpus)
+        elapsed = time.perf_counter() - t0
+        q_vecs = embedder.encode(queries)
+        neighbours = np.argsort(-(q_vecs @ doc_vecs.T), axis=1)[:, :top_k]
+        row = {"texts_per_sec": len(corpus) / elapsed if elapsed > 0 else float("inf")}
+        if reference is None:
+            reference = (doc_vecs, neighbours)
+        else:
+            ref_vecs, ref_neighbours = reference
+            cos = np.sum(doc_vecs * ref_vecs, axis=1)
+            overlap = [len(set(a) & set(b)) / top_k for a, b in zip(neighbours, ref_neighbours)]
+            row.update({
+                "cosine_mean": float(cos.mean()),
+                "cosine_min": float(cos.min()),
+                f"top{top_k}_overlap": float(np.mean(overlap)),
+            })
+        results[name] = row
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from backend.document_parser import extract_text
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    pdf_path = sys.argv[1] if len(sys.argv) > 1 else "Track_B_Tenancy_Agreement.pdf"
+    with open(pdf_path, "rb") as f:
+        text = extract_text(pdf_path, f.read())
+    corpus = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100).split_text(text)
+    queries = [
+        "What is the monthly rental amount?",
+        "Who is responsible for aircon servicing?",
+        "How much is the security deposit?",
+        "When does the tenancy start?",
+        "Can the tenant terminate the lease early?",
+    ]
+    print(f"Corpus: {len(corpus)} chunks from {pdf_path}")
+    for name, row in benchmark(corpus, queries).items():
+        print(f"{name:>14}: " + ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
@@ -1,51 +1,154 @@
 # main.py
+# 运行方式（在项目根目录）：
+#   uvicorn backend.main:app --host 0.0.0.0 --port 8000 --workers 4
+# 多个 worker 共享 data/vector_index 下的磁盘索引（见 vectorstore.SimpleVectorStore 的文件锁与重载）。
 from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
 import os
+import sys
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"   # 避免 Metal 报错
 os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["MKL_NUM_THREADS"] = "1"
 os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
 
-from document_parser import parse_file
-from rag_pipeline import add_document_to_store, answer_question, retrieve_relevant
-import uuid
-from typing import List
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-app = FastAPI()
-UPLOAD_DIR = "data/uploads"
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Optional
+
+from backend import rag_pipeline
+from backend import tracing
+from backend import house_kb, ingest_jobs
+
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "../data/uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...), doc_id: str = Form(None)):
-    content = await file.read()
-    text = parse_file(file.filename, content)
-    if not text.strip():
-        return JSONResponse({"status": "error", "message": "No text extracted from file."}, status_code=400)
-    if doc_id is None:
-        doc_id = str(uuid.uuid4())
+# 摄取（逐页解析 + embedding，大 PDF 的解析 / OCR 由 document_parser 自己开进程池）和问答都在线程池里执行
+EMBED_WORKERS = int(os.environ.get("RENTBOT_EMBED_WORKERS", "8"))   # embedding / LLM 调用以 IO 为主，用线程池
+
+_pools = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _pools["embed"] = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="rag")
+    ingest_jobs.start_workers()   # /upload 带 house_id 时进入 house KB 摄取队列
+    yield
+    _pools["embed"].shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def _in_pool(name, fn, *args, **kwargs):
+    """把阻塞调用放到对应的池里执行，事件循环不被阻塞"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pools[name], partial(fn, *args, **kwargs))
+
+
+def _ingest_upload(content, filename, doc_id=None, namespace=None):
+    """（线程池中执行）哈希 + 逐页流式摄取 + 保存原文件，返回 (doc_id, chunk 数)"""
+    # 与侧边栏一样传原始字节：按内容哈希查 embedding 缓存，未命中时逐页流式摄取；
+    # 未指定 doc_id 时由内容哈希生成，同一文件重复上传只会增量更新，不会产生重复 chunk
+    file_type = os.path.splitext(filename)[1].lstrip(".").lower() or "txt"
+    doc_id = rag_pipeline.add_document_from_file(
+        content, file_type=file_type, doc_id=doc_id, namespace=namespace,
+        cache_key=rag_pipeline.document_cache_key(content),
+    )
     # save raw file
-    path = os.path.join(UPLOAD_DIR, f"{doc_id}_{file.filename}")
+    path = os.path.join(UPLOAD_DIR, f"{doc_id}_{os.path.basename(filename)}")
     with open(path, "wb") as f:
         f.write(content)
-    chunk_count = add_document_to_store(doc_id, text)
-    return {"status": "ok", "doc_id": doc_id, "chunks": chunk_count}
+    return doc_id, rag_pipeline.get_store(namespace).list_documents().get(doc_id, 0)
+
+
+@app.post("/upload")
+async def upload_file(
+    file: UploadFile = File(...),
+    doc_id: str = Form(None),
+    namespace: str = Form(None),
+    house_id: Optional[int] = Form(None),
+):
+    content = await file.read()
+    filename = os.path.basename(file.filename or "") or "upload.txt"
+    if house_id is not None:
+        # house KB 文件与房东页面上传走同一条路：存盘 + 入摄取队列，由 worker 写索引、house_documents 并更新 kb_version
+        job_id = await _in_pool("embed", house_kb.upload_house_document, house_id, content, filename)
+        return {"status": "accepted", "job_id": job_id, "house_id": house_id}
+    try:
+        doc_id, chunks = await _in_pool("embed", _ingest_upload, content, filename, doc_id=doc_id, namespace=namespace)
+    except ValueError as e:   # 抽不出文字
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+    return {"status": "ok", "doc_id": doc_id, "chunks": chunks}
+
 
 @app.post("/ask")
-async def ask_question(question: str = Form(...)):
-    result = answer_question(question)
-    return result
+async def ask_question(question: str = Form(...), namespace: str = Form(None), top_k: int = Form(8)):
+    answer = await _in_pool("embed", rag_pipeline.query_rag, question, top_k=top_k, namespace=namespace)
+    return {"question": question, "answer": answer}
+
+
+@app.post("/ask/stream")
+async def ask_question_stream(question: str = Form(...), namespace: str = Form(None), top_k: int = Form(8)):
+    """Server-Sent Events：每个 data 事件是一段增量文本，最后发送 event: done"""
+    gen = rag_pipeline.query_rag_stream(question, top_k=top_k, namespace=namespace)
+    sentinel = object()
+
+    async def events():
+        step = None   # 线程池里正在执行的 next(gen)
+        try:
+            while True:
+                # 同步生成器的每一步（embedding / 等待 LLM token）都在线程池里推进
+                step = _pools["embed"].submit(next, gen, sentinel)
+                piece = await asyncio.wrap_future(step)
+                if piece is sentinel:
+                    break
+                yield f"data: {json.dumps({'delta': piece}, ensure_ascii=False)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'message': str(e)}, ensure_ascii=False)}\n\n"
+        finally:
+            # 客户端断开时 next(gen) 可能仍在线程池里执行：等它结束后再在线程池里 close，
+            # 生成器的 finally（结束 span、关闭 LLM 流）照常执行，也不会阻塞事件循环
+            def close(_=None):
+                _pools["embed"].submit(gen.close)
+            if step is not None and not step.done():
+                step.add_done_callback(close)
+            else:
+                close()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 
 @app.get("/list_docs")
-async def list_docs():
-    # naive: read metadata from vectorstore
-    from rag_pipeline import vs
+async def list_docs(namespace: str = None):
+    # 每个分片的 {doc_id: chunk 数}
+    namespaces = [namespace] if namespace else rag_pipeline.stores.namespaces()
     docs = {}
-    for m in vs.metadata:
-        docs.setdefault(m["doc_id"], 0)
-        docs[m["doc_id"]] += 1
+    for ns in namespaces:
+        docs[ns] = await _in_pool("embed", lambda n=ns: rag_pipeline.get_store(n).list_documents())
     return {"docs": docs}
 
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus 抓取入口：各阶段耗时直方图 + token 计数（RENTBOT_TRACING=1 时才有数据）。
+    多 worker 部署时每个进程各自计数，按实例分别抓取。
+    """
+    return PlainTextResponse(tracing.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/traces")
+async def traces(limit: int = 50, trace_id: Optional[int] = None):
+    """最近的 span（可按 trace_id 查看一次请求的完整链路）和各阶段的分位数"""
+    return {"spans": tracing.recent_spans(limit, trace_id), "summary": tracing.summary()}
+
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, workers=int(os.environ.get("RENTBOT_API_WORKERS", "1")))
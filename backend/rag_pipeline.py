@@ -1,14 +1,23 @@
 # backend/rag_pipeline.py
 """
 RAG 核心流程：文档加载 → 分块 → 向量化 → 检索
+重量级组件（本地 embedding 模型、文本切分器、PDF / OCR 解析库）在第一次用到时才加载，
+只做检索的进程不需要为它们付导入成本。
 """
 import os
+import time
+import hashlib
+import itertools
+import threading
 import numpy as np
-import streamlit as st
-from sklearn.metrics.pairwise import cosine_similarity
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+from backend.llm_client import get_client
+from backend.vectorstore import ShardedVectorStore
+from backend import embed_cache
+from backend import ingest
+from backend.answer_cache import SemanticAnswerCache
+from backend import embeddings as lexical
+from backend import tracing
+from backend import context_builder
 
 # ===========================================
 # 🔧 可配置参数
@@ -16,88 +25,463 @@ from openai import OpenAI
 USE_OPENAI_EMBEDDING = True   # 改为 True 则使用 OpenAI embedding
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 100
-EMBED_DIM = 384   # all-MiniLM-L6-v2 输出维度
+EMBED_DIM = 1536 if USE_OPENAI_EMBEDDING else 384   # text-embedding-3-small / all-MiniLM-L6-v2 输出维度
+# 本地 embedding（USE_OPENAI_EMBEDDING = False 时）：从 models/ 加载，完全离线
+# "torch"（fp32）/ "onnx" / "onnx-int8" / "openvino" / "openvino-int8"，见 backend/local_embedder.py
+LOCAL_EMBED_BACKEND = "openvino-int8"
+if USE_OPENAI_EMBEDDING:
+    EMBED_MODEL = "text-embedding-3-small"
+else:
+    # 实际使用的后端（所选变体不可用时为 torch）也是模型标识的一部分：
+    # 不同后端的向量不完全一致，索引目录 / embedding 缓存 / 文档缓存 key 都按它区分
+    from backend.local_embedder import resolve_backend
+    EMBED_BACKEND = resolve_backend(LOCAL_EMBED_BACKEND)
+    EMBED_MODEL = f"all-MiniLM-L6-v2-{EMBED_BACKEND}"
+# 按 embedding 模型分目录，切换模型时不会读到维度不一致的旧索引
+VECTOR_DIR = os.path.join(os.path.dirname(__file__), "../data/vector_index", EMBED_MODEL)
+# 检索后端：分片 chunk 数小于 ANN_MIN_SIZE 时精确检索，超过后改用 ANN 索引
+ANN_BACKEND = "hnsw"          # "hnsw" / "ivf"；None 则始终精确检索
+ANN_MIN_SIZE = 20000
+HNSW_M = 32                   # 图的连接数，越大召回越高、内存越大
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64           # 查询时的候选数，越大召回越高、越慢
+IVF_NPROBE = 8                # IVF 查询时扫描的聚类数
+# 文本 embedding 缓存：进程内 LRU 条数；EMBED_DISK_CACHE 为 None 则不落盘。
+# 磁盘缓存默认关闭（RENTBOT_EMBED_DISK_CACHE=1 打开），最多保留 EMBED_DISK_MAX_ROWS 条，超出后删掉最早写入的
+EMBED_LRU_SIZE = 4096
+EMBED_DISK_CACHE = (
+    os.path.join(os.path.dirname(__file__), "../data/embed_cache.sqlite")
+    if os.environ.get("RENTBOT_EMBED_DISK_CACHE", "0") == "1" else None
+)
+EMBED_DISK_MAX_ROWS = 50_000   # 1536 维 float32 每条约 6 KB，上限约 300 MB
+# 语义答案缓存：同一 KB 版本下，相似度 ≥ 阈值的问题直接复用答案
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL = 3600       # 秒
+# 混合检索：dense 与 BM25 词法检索的结果按 reciprocal-rank fusion 合并
+# HYBRID_LEXICAL_WEIGHT 为词法一侧的权重（dense 为 1 - 该值）；0 表示只用 dense
+HYBRID_LEXICAL_WEIGHT = 0.5
+HYBRID_CANDIDATES = 4         # 每一路先取 top_k * HYBRID_CANDIDATES 个候选再融合
+RRF_K = 60
+# 检索结果组装成 context 时的 token 上限（按 CHAT_MODEL 的 tokenizer 计）；None 则不限制
+CONTEXT_TOKEN_BUDGET = 3000
 # ===========================================
 
 # ✅ 模型初始化
+# _embed_batch 只负责“一次请求”；批次大小由下面的 token 预算 / 条数上限决定
 if USE_OPENAI_EMBEDDING:
-    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-    def embed_texts(texts):
-        resp = client.embeddings.create(
+    EMBED_BATCH_TOKENS = 100_000   # 单次请求的 token 预算（接口上限 300k）
+    EMBED_BATCH_SIZE = 2048        # 单次请求最多条数（接口上限）
+    EMBED_MAX_WORKERS = 4          # 同时在途的请求数
+    def _embed_batch(texts):
+        resp = get_client().embeddings.create(
             input=texts,
             model="text-embedding-3-small"
         )
         return np.array([d.embedding for d in resp.data])
 else:
-    embedder = SentenceTransformer('all-MiniLM-L6-v2')
-    def embed_texts(texts):
-        return embedder.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    EMBED_BATCH_TOKENS = 16_000
+    EMBED_BATCH_SIZE = 64
+    EMBED_MAX_WORKERS = 2
+    _embedder = None
+    _embedder_lock = threading.Lock()
+    def _embed_batch(texts):
+        global _embedder
+        if _embedder is None:
+            with _embedder_lock:   # 并发的第一次调用只加载一次模型
+                if _embedder is None:
+                    from backend.local_embedder import LocalEmbedder
+                    # 只加载 EMBED_BACKEND，不再静默退回其他后端（否则与索引 / 缓存的 key 不一致）
+                    _embedder = LocalEmbedder(EMBED_BACKEND, max_batch=EMBED_BATCH_SIZE, fallback=False)
+        return _embedder.encode(texts)
+
+
+text_cache = embed_cache.TextEmbeddingCache(
+    EMBED_MODEL, max_entries=EMBED_LRU_SIZE, disk_path=EMBED_DISK_CACHE, max_disk_rows=EMBED_DISK_MAX_ROWS
+)
+
+
+def _trace_embedding_tokens(s, texts):
+    # token 数只在追踪打开时才计算
+    if tracing.enabled():
+        n = sum(ingest.count_tokens(t) for t in texts)
+        s.set(tokens=n)
+        tracing.add_tokens("embedding", n)
+
+
+def embed_texts(texts):
+    """
+    先查文本 embedding 缓存，只对未命中的文本做 embedding：
+    按 token 预算分批、有限并发；单批失败只重试该批
+    """
+    texts = list(texts)
+    with tracing.span("embed", texts=len(texts)) as s:
+        vecs, missing = text_cache.get_many(texts)
+        s.set(cache_misses=len(missing))
+        if missing:
+            todo = [texts[i] for i in missing]
+            _trace_embedding_tokens(s, todo)
+            t0 = time.perf_counter()
+            new = ingest.embed_in_batches(
+                todo,
+                _embed_batch,
+                max_tokens=EMBED_BATCH_TOKENS,
+                max_items=EMBED_BATCH_SIZE,
+                max_workers=EMBED_MAX_WORKERS,
+            )
+            text_cache.put_many(todo, new, time.perf_counter() - t0)
+            for j, i in enumerate(missing):
+                vecs[i] = new[j]
+    if not vecs:
+        return np.zeros((0, EMBED_DIM), dtype="float32")
+    return np.vstack(vecs)
+
+
+def _embed_batch_cached(texts):
+    """流式摄取用的单批 embedding：同样先查文本缓存，只请求未命中的部分"""
+    with tracing.span("embed", texts=len(texts), batch=True) as s:
+        vecs, missing = text_cache.get_many(texts)
+        s.set(cache_misses=len(missing))
+        if missing:
+            todo = [texts[i] for i in missing]
+            _trace_embedding_tokens(s, todo)
+            t0 = time.perf_counter()
+            new = np.asarray(_embed_batch(todo), dtype="float32")
+            text_cache.put_many(todo, new, time.perf_counter() - t0)
+            for j, i in enumerate(missing):
+                vecs[i] = new[j]
+    return np.vstack(vecs)
+
+
+def chunk_hash(text: str) -> str:
+    """chunk 内容哈希：重新摄取同一文档时据此判断哪些 chunk 没变"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def embed_chunk_stream(chunks, known=None, on_start=None):
+    """
+    边产出 chunk 边 embedding（见 ingest.embed_stream），按顺序逐批 yield (batch_chunks, embeddings)。
+    known: {chunk_hash: 向量}，命中的 chunk 直接复用（文档修订后只 embedding 改动的部分）
+    on_start: 第一批 embedding 提交前调用一次
+    """
+    embed_batch = _embed_batch_cached
+    if known:
+        def embed_batch(texts):
+            out = np.zeros((len(texts), EMBED_DIM), dtype="float32")
+            todo = []
+            for i, t in enumerate(texts):
+                vec = known.get(chunk_hash(t))
+                if vec is None:
+                    todo.append(i)
+                else:
+                    out[i] = vec
+            if todo:
+                out[todo] = _embed_batch_cached([texts[i] for i in todo])
+            return out
+    return ingest.embed_stream(
+        chunks,
+        embed_batch,
+        max_tokens=EMBED_BATCH_TOKENS,
+        max_items=EMBED_BATCH_SIZE,
+        max_workers=EMBED_MAX_WORKERS,
+        on_start=on_start,
+    )
 
 # ===========================================
-# 🧩 全局存储
+# 🧩 全局存储（按 namespace 分片、持久化到磁盘的 FAISS 索引）
 # ===========================================
-VEC_STORE = {
-    "texts": [],
-    "embeddings": None
-}
+DEFAULT_NAMESPACE = "default"
+os.makedirs(VECTOR_DIR, exist_ok=True)
+stores = ShardedVectorStore(
+    EMBED_DIM,
+    VECTOR_DIR,
+    ann_backend=ANN_BACKEND,
+    ann_min_size=ANN_MIN_SIZE,
+    hnsw_m=HNSW_M,
+    hnsw_ef_construction=HNSW_EF_CONSTRUCTION,
+    hnsw_ef_search=HNSW_EF_SEARCH,
+    ivf_nprobe=IVF_NPROBE,
+)
+
+
+def house_namespace(house_id) -> str:
+    """某个 house KB 对应的索引分片"""
+    return f"house_{house_id}"
+
+
+def user_namespace(username) -> str:
+    """某个用户自己上传的合同对应的索引分片"""
+    return f"user_{username}"
+
+
+def get_store(namespace=None):
+    return stores.get(namespace or DEFAULT_NAMESPACE)
+
+
+def _as_namespaces(namespace):
+    if namespace is None:
+        return [DEFAULT_NAMESPACE]
+    if isinstance(namespace, str):
+        return [namespace]
+    return list(namespace)
+
+
+answer_cache = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL,
+)
+
+
+def kb_version(namespace=None):
+    """返回 (scope, version)：参与检索的分片及其当前版本，用作答案缓存的 key"""
+    scope = tuple(sorted(_as_namespaces(namespace)))
+    versions = []
+    for ns in scope:
+        versions.append(stores.get(ns).refresh())   # 其他进程可能刚写过这个分片
+    return scope, tuple(versions)
+
+
+def _lexical_search(question, top_k, ns):
+    store = stores.get(ns)
+
+    def build():
+        # 只在分片变化（或被 LRU 淘汰）后才复制 metadata 并重建 BM25 索引
+        _, metas = store.snapshot()
+        texts = [m.get("text", "") if not m.get("deleted") else "" for m in metas]
+        return lexical.LexicalIndex(texts), metas
+
+    # 版本号在 snapshot 之前读：期间若有写入，缓存的是更新的数据，下次查询版本不一致时再重建一次
+    index, metas = lexical.lexical_index(store.index_path, store.refresh(), build)
+    return [(metas[i], score) for i, score in index.search(question, top_k)]
+
+
+def search_chunks(q_vec, top_k=8, namespace=None, question=None, lexical_weight=None):
+    """
+    只在指定的 namespace（可以是多个）里检索。
+    只给 q_vec 时按相似度合并取 top_k；同时给出 question 时做混合检索：
+    dense 与 BM25 各取一批候选，按 reciprocal-rank fusion（权重 lexical_weight，默认 HYBRID_LEXICAL_WEIGHT）合并。
+    返回 [(metadata, 分数)]，混合检索时分数为融合分数。
+    """
+    w = HYBRID_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+    hybrid = question is not None and w > 0
+    n_cand = top_k * HYBRID_CANDIDATES if hybrid else top_k
+    namespaces = _as_namespaces(namespace)
+    dense, sparse = [], []
+    with tracing.span("search", namespaces=",".join(namespaces), top_k=top_k, hybrid=hybrid):
+        for ns in namespaces:
+            dense.extend((ns, m, s) for m, s in stores.get(ns).search(q_vec, top_k=n_cand))
+            if hybrid:
+                sparse.extend((ns, m, s) for m, s in _lexical_search(question, n_cand, ns))
+    dense.sort(key=lambda h: h[2], reverse=True)
+    if not hybrid:
+        return [(m, s) for _, m, s in dense[:top_k]]
+
+    sparse.sort(key=lambda h: h[2], reverse=True)
+    by_key = {}
+    rankings = []
+    for hits in (dense[:n_cand], sparse[:n_cand]):
+        ranking = []
+        for ns, m, _ in hits:
+            key = (ns, m.get("doc_id"), m.get("chunk_id"))
+            by_key[key] = m
+            ranking.append(key)
+        rankings.append(ranking)
+    fused = lexical.reciprocal_rank_fusion(rankings, [1.0 - w, w], k=RRF_K)
+    return [(by_key[key], score) for key, score in fused[:top_k]]
 
 # ===========================================
 # 📄 文本分块（改进策略）
 # ===========================================
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP,
-    separators=[".", "!", "?", "\n\n", "\n", " "],
-)
+_text_splitter = None
+
+
+def get_text_splitter():
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            separators=[".", "!", "?", "\n\n", "\n", " "],
+        )
+    return _text_splitter
+
+def _read_bytes(raw):
+    if hasattr(raw, "read"):
+        raw.seek(0)
+        raw = raw.read()
+    return raw
+
+
+def _extract_document(raw, file_type):
+    """
+    file_type 为 "txt" 且 raw 是字符串时直接使用；
+    否则 raw 是 bytes 或文件对象，按扩展名交给 document_parser 的统一抽取服务（带缓存）
+    """
+    if isinstance(raw, str):
+        return raw.strip()
+    from backend.document_parser import extract_text
+    return extract_text(f"document.{file_type}", _read_bytes(raw)).strip()
+
+
+def _iter_document_pages(raw, file_type):
+    """流式抽取：字符串整体作为一页；bytes / 文件对象按页产出（PDF 逐页，其他格式一次）"""
+    if isinstance(raw, str):
+        yield raw.strip()
+        return
+    from backend.document_parser import iter_pages
+    for page in iter_pages(f"document.{file_type}", _read_bytes(raw)):
+        page = page.strip()
+        if page:
+            yield page
+
 
 def extract_text_from_pdf(file_obj):
-    import fitz
-    file_obj.seek(0)
-    text = ""
-    with fitz.open(stream=file_obj.read(), filetype="pdf") as doc:
-        for page in doc:
-            text += page.get_text()
-    return text.strip()
+    return _extract_document(file_obj, "pdf")
 
 # ===========================================
 # 🚀 构建知识库
 # ===========================================
-def add_document_from_file(raw_text, file_type="txt"):
-    from backend.embeddings import is_fitted  # 可保留原结构
-    text = extract_text_from_pdf(raw_text) if file_type == "pdf" else raw_text.strip()
-    if not text:
-        raise ValueError("❌ No text extracted from document.")
-    chunks = text_splitter.split_text(text)
-    print(f"[INFO] 文本分块完成，共 {len(chunks)} 段")
+def document_cache_key(file_bytes: bytes) -> str:
+    """原始文件内容对应的 embedding 缓存 key（模型或分块参数变化时自动失效）"""
+    return embed_cache.content_key(file_bytes, EMBED_MODEL, CHUNK_SIZE, CHUNK_OVERLAP)
 
-    VEC_STORE["texts"] = chunks
-    VEC_STORE["embeddings"] = embed_texts(chunks)
-    print(f"[INFO] 向量化完成，形状 {VEC_STORE['embeddings'].shape}")
 
-def query_rag(question: str, top_k=8):
+def _chunk_metadatas(doc_id, house_id, chunks, first=0, offsets=None):
+    """chunks 是全文第 first 个 chunk 起的一段；offsets 覆盖到这些 chunk 时带上原文位置"""
+    metas = [
+        {"doc_id": doc_id, "house_id": house_id, "chunk_id": first + i, "chunk_hash": chunk_hash(c), "text": c}
+        for i, c in enumerate(chunks)
+    ]
+    if offsets is not None and len(offsets) >= first + len(chunks):
+        for m, start in zip(metas, offsets[first:first + len(chunks)]):
+            m["start"] = start
+    return metas
+
+
+def add_document_from_file(raw_text, file_type="txt", doc_id=None, house_id=None, cache_key=None, namespace=None,
+                           on_embedding=None):
     """
-    RAG 检索 + 生成：
-    从 VEC_STORE 中检索最相关的文本片段，然后用 LLM 生成回答。
+    抽取 → 分块 → 向量化，并以 doc_id 为单位写入 namespace 对应的索引分片
+    （未指定时：有 house_id 则写入该 house 的分片，否则写入 DEFAULT_NAMESPACE）。
+    raw_text 可以是已抽取的字符串，也可以是文件 bytes / 文件对象（此时 file_type 为扩展名，
+    如 "pdf"、"docx"、"png"）。
+    同一个 doc_id 再次写入时按 chunk 内容哈希做增量更新：没变的 chunk 不再 embedding、
+    原地保留，只 embedding 新增的 chunk，消失的 chunk 在索引中打 tombstone。
+    未指定 doc_id 时按内容哈希生成，重复上传同一份文档不会产生重复 chunk。返回 doc_id。
+
+    传入 cache_key（见 document_cache_key）时，先查 embedding 缓存：
+    命中则跳过解析和 embedding，未命中则边向量化边逐批写入缓存。
+    on_embedding: 进入 embedding 阶段时调用一次（第一批 chunk 提交时；缓存命中时在读出缓存后），
+    摄取队列据此把任务状态从 parsing 切到 embedding。
     """
+    if namespace is None and house_id is not None:
+        namespace = house_namespace(house_id)
+    store = get_store(namespace)
+    with tracing.span("ingest", namespace=namespace or DEFAULT_NAMESPACE) as span:
+        cached = embed_cache.load(cache_key) if cache_key else None
+        if cached is not None:
+            chunks, embeddings = cached
+            offsets = embed_cache.load_offsets(cache_key)
+            if offsets is not None and len(offsets) != len(chunks):   # 旧缓存没有偏移，这些 chunk 只去重不合并
+                offsets = None
+            if doc_id is None:
+                doc_id = "doc_" + cache_key[:16]
+            print(f"[INFO] 命中 embedding 缓存，共 {len(chunks)} 段")
+            if on_embedding is not None:
+                on_embedding()
+            span.set(doc_id=doc_id, chunks=len(chunks), cache_hit=True)
+            with tracing.span("index", chunks=len(chunks)):
+                diff = store.update_document(doc_id, embeddings, _chunk_metadatas(doc_id, house_id, chunks, 0, offsets))
+            n, shape = len(chunks), embeddings.shape
+        else:
+            if not isinstance(raw_text, str):
+                raw_text = _read_bytes(raw_text)
+            if doc_id is None:
+                content = raw_text.encode("utf-8") if isinstance(raw_text, str) else raw_text
+                doc_id = "doc_" + (cache_key or hashlib.sha1(content).hexdigest())[:16]
+            # 页 → chunk → embedding 批次 → 索引全程流式：不拼接整篇文本，第一批 chunk 凑满就开始 embedding，
+            # 每 embedding 完一批就写入索引和缓存，整篇文档的向量不会同时留在内存里
+            pages = _iter_document_pages(raw_text, file_type)
+            if not isinstance(raw_text, str):   # 传入的是已抽取的文本时没有抽取这一步
+                pages = tracing.timed_iter("extract", pages, file_type=file_type)
+            known = store.document_vectors(doc_id)
+            offsets = []   # 每个 chunk 在全文中的起始位置，检索后据此合并相邻 / 重叠的 chunk
+            stream = embed_chunk_stream(
+                ingest.iter_chunks(pages, get_text_splitter(), offsets=offsets), known=known,
+                on_start=on_embedding,
+            )
+            first = next(stream, None)
+            if first is None:   # 先确认有内容，空文档不会动到索引里的旧版本
+                raise ValueError("❌ No text extracted from document.")
 
-    texts = VEC_STORE.get("texts")
-    embeddings = VEC_STORE.get("embeddings")
+            writer = embed_cache.EntryWriter(cache_key) if cache_key else None
+            n, dim = 0, 0
+            index_seconds, t_end = 0.0, None
 
-    # 1️⃣ 如果当前向量库里完全没有东西，就提示“无知识库”
-    if not texts or embeddings is None or len(texts) == 0:
-        return (
-            "📭 No knowledge base available.\n\n"
-            "Please upload a contract OR ask your landlord to upload a house knowledge base."
+            def batches():
+                nonlocal n, dim, index_seconds, t_end
+                for batch, emb in itertools.chain([first], stream):
+                    if writer is not None:
+                        writer.append(batch, emb)
+                    metas = _chunk_metadatas(doc_id, house_id, batch, n, offsets)
+                    n += len(batch)
+                    dim = emb.shape[1]
+                    t = time.perf_counter()
+                    yield emb, metas
+                    index_seconds += time.perf_counter() - t   # 写入这一批的耗时
+                t_end = time.perf_counter()
+
+            try:
+                diff = store.update_document_stream(doc_id, batches())
+            except BaseException:
+                stream.close()
+                if writer is not None:
+                    writer.abort()
+                raise
+            index_seconds += time.perf_counter() - t_end   # 收尾：替换旧版本 / tombstone
+            print(f"[INFO] 文本分块完成，共 {n} 段")
+            if writer is not None:
+                writer.commit(offsets)
+            span.set(doc_id=doc_id, chunks=n, cache_hit=False)
+            tracing.record("index", index_seconds, chunks=n)
+            shape = (n, dim)
+
+        print(
+            f"[INFO] 向量化完成，形状 {shape}（保留 {diff['kept']} / 新增 {diff['added']} / "
+            f"删除 {diff['removed']}），分片 {namespace or DEFAULT_NAMESPACE} 共 {len(store)} 段"
+        )
+    return doc_id
+
+NO_KB_MESSAGE = (
+    "📭 No knowledge base available.\n\n"
+    "Please upload a contract OR ask your landlord to upload a house knowledge base."
+)
+CHAT_MODEL = "gpt-4o"
+SYSTEM_PROMPT = "You are a professional contract Q&A assistant."
+
+
+def _retrieve_context(q_vec, top_k=8, namespace=None, question=None):
+    """
+    在 namespace 指定的分片中检索（给出 question 时为 dense + 词法混合检索），
+    把命中的 chunk 合并相邻段落、去重后按 CONTEXT_TOKEN_BUDGET 组装成 context（见 context_builder）
+    """
+    hits = search_chunks(q_vec, top_k=top_k, namespace=namespace, question=question)
+    with tracing.span("context", chunks=len(hits)) as span:
+        context, stats = context_builder.build_context(hits, token_budget=CONTEXT_TOKEN_BUDGET)
+        span.set(**stats)
+    tracing.add_tokens("context_saved", max(stats["tokens_saved"], 0))
+    if stats["chunks"]:
+        print(
+            f"[context] {stats['chunks']} 段 → {stats['passages']} 段（合并 {stats['merged']}，去重 {stats['duplicates']}，"
+            f"超预算 {stats['over_budget']}），{stats['tokens_naive']} → {stats['tokens']} tokens"
         )
+    return context
 
-    # 2️⃣ 对问题做 embedding
-    q_emb = embed_texts([question])
-    sims = cosine_similarity(q_emb, embeddings)[0]
-    top_idx = np.argsort(sims)[-top_k:][::-1]
-    context = "\n\n".join([texts[i] for i in top_idx])
 
-    # 3️⃣ 构造 prompt
-    prompt = f"""
+def _build_prompt(context: str, question: str) -> str:
+    return f"""
     You are an intelligent rental & contract assistant. 
     Your task is to answer the user's question using the provided context. 
 
@@ -127,29 +511,144 @@ def query_rag(question: str, top_k=8):
     """
 
 
-    if USE_OPENAI_EMBEDDING:
-        client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-        resp = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a professional contract Q&A assistant."},
-                {"role": "user", "content": prompt},
-            ],
+def _context_only_answer(context: str) -> str:
+    # 不调用 LLM 时，直接把检索结果返回
+    return (
+        "📄 Most relevant context:\n\n"
+        + context[:800]
+        + "\n\n(A final answer should be generated by a language model based on the retrieved context)"
+    )
+
+
+def _chat_messages(prompt: str):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _prepare_answer(question, top_k, namespace, span):
+    """
+    query_rag / query_rag_stream 共用的生成前步骤：检查 KB → 问题 embedding → 查语义答案缓存 → 检索 → 构造 prompt。
+    返回 (answer, prompt, cache_key)：
+    - 没有知识库 / 命中答案缓存 / 不调用 LLM 时，answer 为最终回答
+    - 否则 answer 为 None，用 prompt 生成后按 cache_key = (scope, version, q_vec) 写入答案缓存
+    """
+    # 1️⃣ 如果当前向量库里完全没有东西，就提示“无知识库”
+    if not is_fitted(namespace):
+        return NO_KB_MESSAGE, None, None
+
+    # 2️⃣ 对问题做 embedding，先查语义答案缓存
+    q_vec = embed_texts([question])[0]
+    scope, version = kb_version(namespace)
+    cached = answer_cache.lookup(scope, version, q_vec)
+    span.set(cache_hit=cached is not None)
+    if cached is not None:
+        return cached, None, None
+
+    # 3️⃣ 检索 + 构造 prompt
+    context = _retrieve_context(q_vec, top_k=top_k, namespace=namespace, question=question)
+    with tracing.span("prompt") as s:
+        prompt = _build_prompt(context, question)
+        if tracing.enabled():
+            s.set(tokens=ingest.count_tokens(prompt))
+
+    if not USE_OPENAI_EMBEDDING:
+        answer = _context_only_answer(context)
+        answer_cache.store(scope, version, q_vec, answer)
+        return answer, None, None
+    return None, prompt, (scope, version, q_vec)
+
+
+def query_rag(question: str, top_k=8, namespace=None):
+    """
+    RAG 检索 + 生成：
+    只在 namespace 指定的索引分片中检索最相关的文本片段，然后用 LLM 生成回答。
+    namespace 可以是单个分片名或列表（如租客的合同 + 所住 house 的 KB）。
+    """
+    with tracing.span("query", namespaces=",".join(_as_namespaces(namespace))) as span:
+        answer, prompt, cache_key = _prepare_answer(question, top_k, namespace, span)
+        if answer is not None:
+            return answer
+
+        with tracing.span("llm", model=CHAT_MODEL) as s:
+            resp = get_client().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=_chat_messages(prompt),
+                temperature=0.3,
+                max_tokens=512,
+            )
+            usage = getattr(resp, "usage", None)
+            if usage is not None:
+                s.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+                tracing.add_tokens("prompt", usage.prompt_tokens)
+                tracing.add_tokens("completion", usage.completion_tokens)
+        answer = resp.choices[0].message.content.strip()
+        answer_cache.store(*cache_key, answer)
+        return answer
+
+
+def query_rag_stream(question: str, top_k=8, namespace=None):
+    """
+    query_rag 的流式版本：逐段 yield LLM 输出的文本，
+    可直接交给 st.write_stream，首个 token 一到就开始渲染。
+    """
+    # 生成器的每一步可能在不同线程里推进（main.py 的 /ask/stream），span 都手动结束；
+    # 生成前的步骤在同一次 next() 里完成，只在这一段把 root 设为当前 span
+    root = tracing.start_span("query", namespaces=",".join(_as_namespaces(namespace)), stream=True)
+    llm = None
+    try:
+        with tracing.use_span(root):
+            answer, prompt, cache_key = _prepare_answer(question, top_k, namespace, root)
+        if answer is not None:
+            root.end()
+            yield answer
+            return
+
+        llm = tracing.start_span("llm", parent=root, model=CHAT_MODEL, stream=True)
+        t0 = time.perf_counter()
+        stream = get_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=_chat_messages(prompt),
             temperature=0.3,
             max_tokens=512,
+            stream=True,
         )
-        return resp.choices[0].message.content.strip()
-    else:
-        # 不调用 LLM 时，直接把检索结果返回
-        return (
-            "📄 Most relevant context:\n\n"
-            + context[:800]
-            + "\n\n(A final answer should be generated by a language model based on the retrieved context)"
-        )
+        parts = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts:
+                    llm.set(first_token_ms=(time.perf_counter() - t0) * 1000)
+                parts.append(delta)
+                yield delta
+        answer = "".join(parts).strip()
+        if tracing.enabled():
+            # 流式响应不带 usage，按 tokenizer 估算
+            n_prompt = ingest.count_tokens(SYSTEM_PROMPT + prompt)
+            n_completion = ingest.count_tokens(answer)
+            llm.set(prompt_tokens=n_prompt, completion_tokens=n_completion)
+            tracing.add_tokens("prompt", n_prompt)
+            tracing.add_tokens("completion", n_completion)
+        llm.end()
+        # 只有完整生成结束才写入缓存
+        answer_cache.store(*cache_key, answer)
+    except Exception as e:
+        if llm is not None:
+            llm.end(e)
+        root.end(e)
+        raise
+    finally:
+        # 正常结束，或客户端中途断开（GeneratorExit）
+        if llm is not None:
+            llm.end()
+        root.end()
 
 
 # ===========================================
 # ✅ 工具函数
 # ===========================================
-def is_fitted():
-    return VEC_STORE["embeddings"] is not None
+def is_fitted(namespace=None):
+    return any(len(stores.get(ns)) > 0 for ns in _as_namespaces(namespace))
@@ -1,12 +1,21 @@
 # backend/tickets.py
 import os
-from backend.db import get_conn
+from backend.db import connection, transaction
 from datetime import datetime
 import shutil
+import threading
+import time
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "../data/ticket_uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+FEED_PAGE_SIZE = 20
+FEED_CACHE_TTL = 30           # 秒；工单新建 / 回复时会立即失效
+TICKET_STATUSES = ("open", "in_progress", "closed")
+
+_feed_cache = {}              # (landlord_id, status, cursor, limit) -> (过期时间, 结果)
+_feed_lock = threading.Lock()
+
 def create_ticket(title, description, category, priority, creator, creator_role, attachment_file=None, attachment_name=None):
     """保存附件文件并写入 tickets 表，返回 ticket id"""
     att_path = None
@@ -16,21 +25,19 @@ def create_ticket(title, description, category, priority, creator, creator_role,
         with open(att_path, "wb") as f:
             f.write(attachment_file)
     now = datetime.utcnow().isoformat()
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO tickets (title, description, category, priority, creator, creator_role, attachment_path, created_at, updated_at)
-        VALUES (?,?,?,?,?,?,?,?,?)
-    """, (title, description, category, priority, creator, creator_role, att_path, now, now))
-    conn.commit()
-    tid = cur.lastrowid
-    conn.close()
+    with transaction() as conn:
+        # landlord_id 取提交时租客所属的房东（房东面板按它分页）
+        cur = conn.execute("""
+            INSERT INTO tickets (title, description, category, priority, creator, creator_role, attachment_path,
+                                 created_at, updated_at, landlord_id)
+            VALUES (?,?,?,?,?,?,?,?,?, (SELECT landlord_id FROM users WHERE username=?))
+        """, (title, description, category, priority, creator, creator_role, att_path, now, now, creator))
+        tid = cur.lastrowid
+    invalidate_feed_cache()
     return tid
 
 def list_tickets(filter_by=None):
     """filter_by: dict e.g. {'creator': 'alice'} or {'status':'open'}"""
-    conn = get_conn()
-    cur = conn.cursor()
     q = "SELECT * FROM tickets"
     params = []
     if filter_by:
@@ -40,17 +47,13 @@ def list_tickets(filter_by=None):
             params.append(v)
         q += " WHERE " + " AND ".join(clauses)
     q += " ORDER BY created_at DESC"
-    cur.execute(q, params)
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(q, params).fetchall()
     return [dict(r) for r in rows]
 
 def get_ticket(ticket_id):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM tickets WHERE id=?", (ticket_id,))
-    r = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        r = conn.execute("SELECT * FROM tickets WHERE id=?", (ticket_id,)).fetchone()
     return dict(r) if r else None
 
 def update_ticket_response(ticket_id, landlord_response=None, landlord_attachment_bytes=None, landlord_attachment_name=None, new_status=None):
@@ -61,8 +64,6 @@ def update_ticket_response(ticket_id, landlord_response=None, landlord_attachmen
         with open(att_path, "wb") as f:
             f.write(landlord_attachment_bytes)
     now = datetime.utcnow().isoformat()
-    conn = get_conn()
-    cur = conn.cursor()
     # build update
     updates = []
     params = []
@@ -81,7 +82,58 @@ def update_ticket_response(ticket_id, landlord_response=None, landlord_attachmen
     params.append(now)
     params.append(ticket_id)
     q = f"UPDATE tickets SET {', '.join(updates)} WHERE id=?"
-    cur.execute(q, params)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(q, params)
+    invalidate_feed_cache()
     return True
+
+
+# ----------------------------
+# Landlord dashboard feed
+# ----------------------------
+def invalidate_feed_cache():
+    with _feed_lock:
+        _feed_cache.clear()
+
+
+def landlord_ticket_feed(landlord_id, status=None, cursor=None, limit=FEED_PAGE_SIZE):
+    """
+    某个房东的所有租客提交的工单，按 (created_at, id) 倒序分页：
+    按 tickets.landlord_id 走 (landlord_id, [status,] created_at, id) 索引，每页只读一段有界的索引范围，
+    代价与翻到第几页无关。
+    cursor 为上一页返回的 next_cursor（最后一条的 (created_at, id)），None 表示第一页。
+    返回 (tickets, next_cursor)；没有下一页时 next_cursor 为 None。
+    结果缓存 FEED_CACHE_TTL 秒，工单新建 / 回复时失效。
+    """
+    key = (landlord_id, status, tuple(cursor) if cursor else None, limit)
+    now = time.monotonic()
+    with _feed_lock:
+        hit = _feed_cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+
+    q = "SELECT * FROM tickets WHERE landlord_id = ?"
+    params = [landlord_id]
+    if status:
+        q += " AND status = ?"
+        params.append(status)
+    if cursor:
+        q += " AND (created_at, id) < (?, ?)"
+        params.extend(cursor)
+    q += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit + 1)   # 多取一条判断是否还有下一页
+
+    with connection() as conn:
+        rows = [dict(r) for r in conn.execute(q, params).fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]["created_at"], rows[-1]["id"])
+    result = (rows, next_cursor)
+
+    with _feed_lock:
+        _feed_cache[key] = (now + FEED_CACHE_TTL, result)
+        # 顺手清掉过期条目，避免翻页多了以后无限增长
+        for k in [k for k, (exp, _) in _feed_cache.items() if exp <= now]:
+            del _feed_cache[k]
+    return result
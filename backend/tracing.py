@@ -0,0 +1,339 @@
+# backend/tracing.py
+"""
+RAG 链路的轻量追踪：span（带父子关系和属性）+ 按阶段的耗时直方图 + token 计数。
+
+    with tracing.span("embed", texts=3):          # 上下文管理器
+        ...
+    s = tracing.start_span("llm"); ...; s.end()   # 跨 yield / 跨线程的流式调用用手动结束
+
+默认关闭（RENTBOT_TRACING=1 或 enable() 打开）：关闭时 span() 只做一次布尔判断并返回共享的空对象，
+调用方需要额外计算的属性（如 token 数）用 enabled() 判断后再算。
+导出：
+- prometheus_text()：Prometheus 文本格式（backend/main.py 的 GET /metrics）
+- 安装了 opentelemetry-api 且 RENTBOT_OTEL=1 时，每个 span 同时作为 OpenTelemetry span 发出
+  （exporter / 采样由应用侧的 OTel SDK 配置决定）
+- recent_spans() / summary()：进程内最近的 span 和各阶段分位数，调试用
+"""
+import os
+import time
+import itertools
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import deque
+
+# ===========================================
+# 🔧 可配置参数
+# ===========================================
+TRACING_ENABLED = os.environ.get("RENTBOT_TRACING", "0") == "1"
+OTEL_ENABLED = os.environ.get("RENTBOT_OTEL", "0") == "1"
+TRACE_BUFFER_SIZE = 2048          # 保留最近多少个结束的 span
+# 直方图桶上界（秒），Prometheus 默认桶再往两端各扩一些：覆盖 1ms 的缓存命中到 60s 的大文档摄取
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "rentbot"
+# ===========================================
+
+_enabled = TRACING_ENABLED
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_current = contextvars.ContextVar("rentbot_span", default=None)
+_histograms = {}                  # stage -> [每个桶的计数..., +Inf 计数, sum]
+_errors = {}                      # stage -> 出错次数
+_tokens = {}                      # kind -> token 数
+_finished = deque(maxlen=TRACE_BUFFER_SIZE)
+
+_tracer = None
+if OTEL_ENABLED:
+    try:
+        from opentelemetry import trace as _otel_trace
+        _tracer = _otel_trace.get_tracer("rentbot")
+    except Exception:   # opentelemetry 可选，没装时只保留进程内指标
+        print("[tracing] RENTBOT_OTEL=1 but opentelemetry-api is not installed; OTel export disabled")
+
+
+def enable(on: bool = True):
+    global _enabled
+    _enabled = on
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """清空所有指标和缓存的 span（测试 / 基准测试之间使用）"""
+    with _lock:
+        _histograms.clear()
+        _errors.clear()
+        _tokens.clear()
+        _finished.clear()
+
+
+# ===========================================
+# 📏 指标
+# ===========================================
+def observe(stage: str, seconds: float, error: bool = False):
+    """往 stage 的耗时直方图里记一次"""
+    with _lock:
+        h = _histograms.get(stage)
+        if h is None:
+            h = _histograms[stage] = [0] * (len(BUCKETS) + 2)
+        h[bisect_left(BUCKETS, seconds)] += 1
+        h[-1] += seconds
+        if error:
+            _errors[stage] = _errors.get(stage, 0) + 1
+
+
+def add_tokens(kind: str, n: int):
+    """token 计数（kind: embedding / prompt / completion）"""
+    if not _enabled or not n:
+        return
+    with _lock:
+        _tokens[kind] = _tokens.get(kind, 0) + int(n)
+
+
+# ===========================================
+# 🧵 Span
+# ===========================================
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+    def end(self, error=None):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    def __init__(self, name, attrs, parent=None):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.span_id = next(_ids)
+        parent = parent if parent is not None else _current.get()
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._token = None
+        self._otel = _tracer.start_span(name, attributes=_otel_attrs(self.attrs)) if _tracer else None
+        self._ended = False
+
+    def set(self, **attrs):
+        """补充属性（如生成结束后的 token 数）"""
+        self.attrs.update(attrs)
+        return self
+
+    def end(self, error=None):
+        if self._ended:
+            return
+        self._ended = True
+        seconds = time.perf_counter() - self._t0
+        if error is not None:
+            self.attrs["error"] = f"{type(error).__name__}: {error}"
+        observe(self.name, seconds, error is not None)
+        with _lock:
+            _finished.append({
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "start": self.start,
+                "duration_ms": seconds * 1000,
+                "attrs": self.attrs,
+            })
+        if self._otel is not None:
+            self._otel.set_attributes(_otel_attrs(self.attrs))
+            if error is not None:
+                self._otel.record_exception(error)
+            self._otel.end()
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        if self._otel is not None:
+            self._otel_ctx = _otel_trace.use_span(self._otel, end_on_exit=False)
+            self._otel_ctx.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._otel is not None:
+            self._otel_ctx.__exit__(exc_type, exc, tb)
+        _current.reset(self._token)
+        self.end(exc)
+        return False
+
+
+def _otel_attrs(attrs):
+    # OTel 属性只接受基本类型
+    return {k: v if isinstance(v, (str, bool, int, float)) else str(v) for k, v in attrs.items()}
+
+
+def span(name: str, **attrs):
+    """with span("search", top_k=8): ... —— 块内新建的 span 以它为父 span"""
+    if not _enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def start_span(name: str, parent=None, **attrs):
+    """
+    手动结束的 span（调用 .end()）：不会成为当前 span，适合跨 yield 的流式生成——
+    生成器的每一步可能在不同线程里推进（见 main.py 的 /ask/stream）
+    """
+    if not _enabled:
+        return _NOOP
+    return Span(name, attrs, parent=parent)
+
+
+def use_span(s):
+    """把一个手动 span 临时设为当前 span（不结束它），块内新建的 span 以它为父"""
+    if s is _NOOP:
+        return _NOOP
+    return _UseSpan(s)
+
+
+class _UseSpan:
+    def __init__(self, s):
+        self.span = s
+
+    def __enter__(self):
+        self._token = _current.set(self.span)
+        if self.span._otel is not None:
+            self._otel_ctx = _otel_trace.use_span(self.span._otel, end_on_exit=False)
+            self._otel_ctx.__enter__()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span._otel is not None:
+            self._otel_ctx.__exit__(exc_type, exc, tb)
+        _current.reset(self._token)
+        return False
+
+
+def current_span():
+    return _current.get() if _enabled else None
+
+
+def record(name: str, seconds: float, **attrs):
+    """
+    记录一段已经测好的耗时（例如流式摄取中分散在多次调用里、累加起来的抽取 / 分块时间）：
+    计入直方图，并作为当前 span 的子 span 保存
+    """
+    if not _enabled:
+        return
+    parent = _current.get()
+    span_id = next(_ids)
+    observe(name, seconds)
+    with _lock:
+        _finished.append({
+            "name": name,
+            "trace_id": parent.trace_id if parent else span_id,
+            "span_id": span_id,
+            "parent_id": parent.span_id if parent else None,
+            "start": time.time() - seconds,
+            "duration_ms": seconds * 1000,
+            "attrs": attrs,
+        })
+
+
+def timed_iter(name: str, iterable, **attrs):
+    """逐个产出 iterable 的元素，把花在取下一个元素上的时间累加，迭代结束时 record(name, 总耗时)"""
+    if not _enabled:
+        yield from iterable
+        return
+    it = iter(iterable)
+    total, n = 0.0, 0
+    while True:
+        t0 = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            total += time.perf_counter() - t0
+            break
+        total += time.perf_counter() - t0
+        n += 1
+        yield item
+    record(name, total, items=n, **attrs)
+
+
+# ===========================================
+# 📤 导出
+# ===========================================
+def recent_spans(limit: int = 100, trace_id=None):
+    """最近结束的 span（最新的在后），可按 trace_id 过滤出一次请求的完整链路"""
+    with _lock:
+        spans = list(_finished)
+    if trace_id is not None:
+        spans = [s for s in spans if s["trace_id"] == trace_id]
+    return spans[-limit:]
+
+
+def _quantile(counts, total, q):
+    # 直方图近似分位数：返回第一个累计数达到 q 的桶上界
+    target, seen = q * total, 0
+    for upper, c in zip(BUCKETS + (float("inf"),), counts):
+        seen += c
+        if seen >= target:
+            return upper
+    return float("inf")
+
+
+def summary():
+    """{stage: {"count", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms"}}；分位数为桶上界近似"""
+    with _lock:
+        snapshot = {k: list(v) for k, v in _histograms.items()}
+        errors = dict(_errors)
+    out = {}
+    for stage, h in snapshot.items():
+        counts, total_s = h[:-1], h[-1]
+        n = sum(counts)
+        out[stage] = {
+            "count": n,
+            "errors": errors.get(stage, 0),
+            "mean_ms": total_s / n * 1000 if n else 0.0,
+            **{f"p{int(q * 100)}_ms": _quantile(counts, n, q) * 1000 for q in (0.5, 0.95, 0.99)},
+        }
+    return out
+
+
+def token_counts():
+    with _lock:
+        return dict(_tokens)
+
+
+def prometheus_text() -> str:
+    """Prometheus 文本格式（0.0.4）的全部指标"""
+    with _lock:
+        snapshot = {k: list(v) for k, v in _histograms.items()}
+        errors = dict(_errors)
+        tokens = dict(_tokens)
+    name = f"{METRIC_PREFIX}_stage_duration_seconds"
+    lines = [f"# HELP {name} Duration of RAG pipeline stages.", f"# TYPE {name} histogram"]
+    for stage in sorted(snapshot):
+        h = snapshot[stage]
+        cumulative = 0
+        for upper, c in zip(BUCKETS, h):
+            cumulative += c
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{upper}"}} {cumulative}')
+        cumulative += h[len(BUCKETS)]
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {h[-1]}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+
+    name = f"{METRIC_PREFIX}_stage_errors_total"
+    lines += [f"# HELP {name} RAG pipeline stages that raised.", f"# TYPE {name} counter"]
+    lines += [f'{name}{{stage="{s}"}} {n}' for s, n in sorted(errors.items())]
+
+    name = f"{METRIC_PREFIX}_tokens_total"
+    lines += [f"# HELP {name} Tokens sent to / received from models.", f"# TYPE {name} counter"]
+    lines += [f'{name}{{kind="{k}"}} {n}' for k, n in sorted(tokens.items())]
+    return "\n".join(lines) + "\n"
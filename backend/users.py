@@ -1,6 +1,7 @@
 # backend/users.py
-from backend.db import get_conn
+from backend.db import connection, transaction
 import hashlib
+import sqlite3
 
 def hash_pw(pw: str):
     """生成 SHA256 哈希"""
@@ -8,38 +9,31 @@ def hash_pw(pw: str):
 
 def register_user(username, password, role, landlord_username=None, house_id=None):
     """注册用户，如果是租客则绑定房东 & house_id"""
-    conn = get_conn()
-    cur = conn.cursor()
-
-    landlord_id = None
-    if role == "tenant" and landlord_username:
-        cur.execute("SELECT id FROM users WHERE username=? AND role='landlord'", (landlord_username,))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
-            return False, "Landlord not found."
-        landlord_id = row["id"]
-
     try:
-        cur.execute("""
-            INSERT INTO users (username, password, role, landlord_id, tenant_house_id)
-            VALUES (?, ?, ?, ?, ?)
-        """, (username, hash_pw(password), role, landlord_id, house_id))
-        conn.commit()
+        with transaction() as conn:
+            cur = conn.cursor()
+
+            landlord_id = None
+            if role == "tenant" and landlord_username:
+                cur.execute("SELECT id FROM users WHERE username=? AND role='landlord'", (landlord_username,))
+                row = cur.fetchone()
+                if not row:
+                    return False, "Landlord not found."
+                landlord_id = row["id"]
+
+            cur.execute("""
+                INSERT INTO users (username, password, role, landlord_id, tenant_house_id)
+                VALUES (?, ?, ?, ?, ?)
+            """, (username, hash_pw(password), role, landlord_id, house_id))
         return True, "Registered successfully!"
-    except Exception as e:
+    except sqlite3.Error as e:
         return False, f"Error: {e}"
-    finally:
-        conn.close()
 
 
 def login_user(username, password):
     """验证用户名和密码"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE username=?", (username,))
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
 
     if not row:
         return False, "❌ User not found."
@@ -49,11 +43,8 @@ def login_user(username, password):
 
 def get_user_id_by_name(username):
     """Return user ID from username"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE username=?", (username,))
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
     if row:
         return row["id"]
     return None
@@ -7,54 +7,575 @@ os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["MKL_NUM_THREADS"] = "1"
 os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
 
+import hashlib
 import pickle
-from typing import List, Tuple
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:   # Windows：没有 flock，只保证进程内安全
+    fcntl = None
 
 # We'll store:
 # - a FAISS index stored to disk
-# - metadata list (parallel to vectors) saved as pickle: list of dicts {doc_id, chunk_id, text}
+# - metadata list (parallel to vectors) saved as pickle: list of dicts {doc_id, house_id, chunk_id, chunk_hash, text}
+#
+# The index is append-only per document: adding a doc_id that already exists
+# replaces its chunks, and delete_document() removes them without touching
+# (or re-embedding) any other document.
+#
+# update_document() diffs a re-ingested document by metadata["chunk_hash"]:
+# unchanged chunks stay where they are, new ones are appended, and removed ones
+# are tombstoned (metadata {"deleted": True}) instead of physically removed, so
+# positions - and any ANN index built over them - stay valid. Tombstones are
+# skipped by search / listing and compacted away once they exceed
+# TOMBSTONE_COMPACT_RATIO of the shard. update_document_stream() does the same
+# diff batch by batch while the document is still being embedded: new chunks
+# (tagged with a per-write "rev") are appended as they arrive, and the old
+# version is only swapped out once the last batch is in.
+#
+# Search backend:
+# - the IndexFlatIP above is the source of truth (supports remove_ids / reconstruct)
+# - shards smaller than ann_min_size are searched exactly with a numpy matmul
+#   plus argpartition top-k
+# - larger shards get an auxiliary ANN index (HNSW or IVF) built from the flat
+#   vectors, kept up to date by incremental add and saved next to the flat index
+#   (<index_path>.ann). Deletes mark it stale; it is rebuilt on the next search.
+#
+# Several processes (e.g. uvicorn workers) may share one shard directory:
+# writes hold an exclusive flock on <index_path>.lock, and every read first
+# checks whether meta.pkl was replaced by another process and reloads if so.
+
+ANN_BACKENDS = ("hnsw", "ivf")
+TOMBSTONE_COMPACT_RATIO = 0.2
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """argpartition 取 top-k（O(N)），只对这 k 个排序"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype="int64")
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx])]
+
 
 class SimpleVectorStore:
-    def __init__(self, dim: int, index_path="vector.index", meta_path="meta.pkl"):
+    def __init__(self, dim: int, index_path="vector.index", meta_path="meta.pkl",
+                 ann_backend: Optional[str] = "hnsw", ann_min_size: int = 20000,
+                 hnsw_m: int = 32, hnsw_ef_construction: int = 80, hnsw_ef_search: int = 64,
+                 ivf_nlist: Optional[int] = None, ivf_nprobe: int = 8):
+        if ann_backend is not None and ann_backend not in ANN_BACKENDS:
+            raise ValueError(f"ann_backend must be one of {ANN_BACKENDS} or None")
         self.dim = dim
         self.index_path = index_path
         self.meta_path = meta_path
+        self.ann_path = index_path + ".ann"
+        # ---- recall / latency knobs ----
+        self.ann_backend = ann_backend
+        self.ann_min_size = ann_min_size
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.ivf_nlist = ivf_nlist          # None: 按 4*sqrt(N)（且每类 ≥39 点）自动选
+        self.ivf_nprobe = ivf_nprobe
+        self._lock = threading.RLock()
+        self._matrix = None                 # 精确检索用的向量矩阵缓存
+        self._ann = None
+        self._ann_stale = False
+        self._tombstones = 0                # metadata 中 deleted=True 的条数
+        self.version = 0                    # 每次落盘 +1（随 meta 持久化），供上层缓存判断 KB 是否变化
+        self._disk_sig = None
+        self._write_depth = 0
         self._load()
 
+    # ----------------------------
+    # Persistence / cross-process sync
+    # ----------------------------
+    def _meta_sig(self):
+        # os.replace 每次都会换 inode，(inode, mtime, size) 足以识别其他进程的写入
+        try:
+            st = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+        d = os.path.dirname(self.index_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(self.index_path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self):
+        """进程内锁 + 跨进程排他文件锁；进入时先同步磁盘上的最新状态"""
+        with self._lock:
+            if self._write_depth:
+                self._write_depth += 1
+                try:
+                    yield
+                finally:
+                    self._write_depth -= 1
+                return
+            with self._file_lock(exclusive=True):
+                self._write_depth = 1
+                try:
+                    self._sync()
+                    yield
+                finally:
+                    self._write_depth = 0
+
+    def _sync(self):
+        """其他进程更新过这个分片时重新加载（调用方需持有 self._lock）"""
+        if self._meta_sig() == self._disk_sig:
+            return
+        if self._write_depth:
+            self._load()
+        else:
+            with self._file_lock(exclusive=False):
+                self._load()
+
+    def refresh(self) -> int:
+        """其他进程写过时重新加载，返回当前 version（不复制 metadata）"""
+        with self._lock:
+            self._sync()
+            return self.version
+
     def _load(self):
         if os.path.exists(self.index_path):
             self.index = faiss.read_index(self.index_path)
+            if self.index.d != self.dim:
+                raise ValueError(
+                    f"Index at {self.index_path} has dim {self.index.d}, expected {self.dim}."
+                )
         else:
             self.index = faiss.IndexFlatIP(self.dim)  # inner product cosine-like if vectors normalized
+        self._disk_sig = self._meta_sig()
         if os.path.exists(self.meta_path):
             with open(self.meta_path, "rb") as f:
-                self.metadata = pickle.load(f)
+                saved = pickle.load(f)
+            if isinstance(saved, dict):
+                self.metadata = saved["metadata"]
+                self.version = saved["version"]
+            else:   # 旧格式：直接是 metadata 列表
+                self.metadata = saved
         else:
             self.metadata = []
+        self._matrix = None
+        self._ann = None
+        self._ann_stale = False
+        self._tombstones = sum(1 for m in self.metadata if m.get("deleted"))
+        if self.ann_backend and os.path.exists(self.ann_path):
+            ann = faiss.read_index(self.ann_path)
+            if ann.ntotal == self.index.ntotal:
+                self._ann = ann
+                self._apply_search_params()
 
     def _save(self):
-        faiss.write_index(self.index, self.index_path)
-        with open(self.meta_path, "wb") as f:
-            pickle.dump(self.metadata, f)
+        # 先写临时文件再替换，避免进程中途退出留下半个索引
+        d = os.path.dirname(self.index_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.version += 1
+        faiss.write_index(self.index, self.index_path + ".tmp")
+        with open(self.meta_path + ".tmp", "wb") as f:
+            pickle.dump({"version": self.version, "metadata": self.metadata}, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+        self._disk_sig = self._meta_sig()
+        if self._ann is not None and not self._ann_stale:
+            faiss.write_index(self._ann, self.ann_path + ".tmp")
+            os.replace(self.ann_path + ".tmp", self.ann_path)
+        elif os.path.exists(self.ann_path):
+            os.remove(self.ann_path)
 
-    def add(self, vectors: List[List[float]], metadatas: List[dict]):
+    # ----------------------------
+    # Search backends
+    # ----------------------------
+    def _use_ann(self) -> bool:
+        return self.ann_backend is not None and self.index.ntotal >= self.ann_min_size
+
+    def _vectors(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = self.index.reconstruct_n(0, self.index.ntotal)
+        return self._matrix
+
+    def _apply_search_params(self):
+        if self._ann is None:
+            return
+        if self.ann_backend == "hnsw":
+            self._ann.hnsw.efSearch = self.hnsw_ef_search
+        else:
+            self._ann.nprobe = self.ivf_nprobe
+
+    def _build_ann(self):
+        vecs = self._vectors()
+        n = len(vecs)
+        if self.ann_backend == "hnsw":
+            ann = faiss.IndexHNSWFlat(self.dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            ann.hnsw.efConstruction = self.hnsw_ef_construction
+        else:
+            # faiss 建议每个聚类至少 39 个训练点
+            nlist = self.ivf_nlist or max(1, min(int(4 * np.sqrt(n)), n // 39))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            ann = faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            ann.train(vecs)
+        ann.add(vecs)
+        self._ann = ann
+        self._ann_stale = False
+        self._apply_search_params()
+        print(f"[vectorstore] Built {self.ann_backend} index over {n} vectors ({self.index_path})")
+
+    def set_search_params(self, hnsw_ef_search: Optional[int] = None, ivf_nprobe: Optional[int] = None):
+        """运行时调整召回率 / 延迟（efSearch、nprobe 越大召回越高、越慢）"""
+        with self._lock:
+            if hnsw_ef_search is not None:
+                self.hnsw_ef_search = hnsw_ef_search
+            if ivf_nprobe is not None:
+                self.ivf_nprobe = ivf_nprobe
+            self._apply_search_params()
+
+    def __len__(self):
+        """有效 chunk 数（不含 tombstone）"""
+        with self._lock:
+            self._sync()
+            return self.index.ntotal - self._tombstones
+
+    def add(self, vectors: List[List[float]], metadatas: List[dict], save: bool = True):
         vecs = np.array(vectors).astype("float32")
+        if len(vecs) != len(metadatas):
+            raise ValueError("vectors and metadatas must have the same length")
+        if len(vecs) == 0:
+            return
         # normalize to unit length for cosine similarity via inner product
         norms = np.linalg.norm(vecs, axis=1, keepdims=True)
         norms[norms == 0] = 1.0
         vecs = vecs / norms
-        self.index.add(vecs)
-        self.metadata.extend(metadatas)
-        self._save()
+        with self._writing():
+            self.index.add(vecs)
+            self.metadata.extend(metadatas)
+            self._matrix = None
+            # 已有的 ANN 索引做增量 add，不重建
+            if self._ann is not None and not self._ann_stale:
+                self._ann.add(vecs)
+            if save:
+                self._save()
 
-    def search(self, query_vec: List[float], top_k: int = 4) -> List[Tuple[dict, float]]:
+    def search(self, query_vec: List[float], top_k: int = 4, exact: bool = False) -> List[Tuple[dict, float]]:
+        """exact=True 时强制走精确检索（用于评估 ANN 召回率）"""
         q = np.array([query_vec]).astype("float32")
         # normalize
         q = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-12)
-        D, I = self.index.search(q, top_k)
-        results = []
-        for idx, score in zip(I[0], D[0]):
-            if idx < 0 or idx >= len(self.metadata):
+        with self._lock:
+            self._sync()
+            if self.index.ntotal == 0:
+                return []
+            # 多取 tombstone 个候选，过滤后仍能凑满 top_k
+            k = min(top_k + self._tombstones, self.index.ntotal)
+            if not exact and self._use_ann():
+                if self._ann is None or self._ann_stale:
+                    self._build_ann()
+                D, I = self._ann.search(q, k)
+                pairs = zip(I[0], D[0])
+            else:
+                sims = self._vectors() @ q[0]
+                idx = _top_k(sims, k)
+                pairs = zip(idx, sims[idx])
+            results = []
+            for idx, score in pairs:
+                if idx < 0 or idx >= len(self.metadata) or self.metadata[idx].get("deleted"):
+                    continue
+                results.append((self.metadata[idx], float(score)))
+        return results[:top_k]
+
+    def evaluate_ann(self, query_vecs, top_k: int = 8) -> dict:
+        """
+        用一批查询向量对比 ANN 与精确检索：返回 recall@k 和两者的平均延迟（ms），
+        用来在真实语料上调 ann_min_size / efSearch / nprobe。
+        """
+        def _key(m):
+            return (m.get("doc_id"), m.get("chunk_id"))
+
+        with self._lock:
+            self._sync()
+            # 先把 ANN 建好，避免把建索引的时间算进第一次查询
+            if self._use_ann() and (self._ann is None or self._ann_stale):
+                self._build_ann()
+        recalls, exact_ms, ann_ms = [], [], []
+        for q in query_vecs:
+            t0 = time.perf_counter()
+            truth = {_key(m) for m, _ in self.search(q, top_k, exact=True)}
+            t1 = time.perf_counter()
+            approx = {_key(m) for m, _ in self.search(q, top_k)}
+            t2 = time.perf_counter()
+            if truth:
+                recalls.append(len(truth & approx) / len(truth))
+            exact_ms.append((t1 - t0) * 1000)
+            ann_ms.append((t2 - t1) * 1000)
+        return {
+            "backend": self.ann_backend if self._use_ann() else "exact",
+            "recall": float(np.mean(recalls)) if recalls else 1.0,
+            "exact_ms": float(np.mean(exact_ms)) if exact_ms else 0.0,
+            "ann_ms": float(np.mean(ann_ms)) if ann_ms else 0.0,
+        }
+
+    # ----------------------------
+    # Per-document management
+    # ----------------------------
+    def snapshot(self) -> Tuple[int, List[dict]]:
+        """(version, metadata 列表的副本)：上层按 version 缓存派生索引（如词法索引）"""
+        with self._lock:
+            self._sync()
+            return self.version, list(self.metadata)
+
+    def has_document(self, doc_id: str) -> bool:
+        with self._lock:
+            self._sync()
+            return any(m.get("doc_id") == doc_id and not m.get("deleted") for m in self.metadata)
+
+    def list_documents(self, house_id: Optional[int] = None) -> Dict[str, int]:
+        """返回 {doc_id: chunk 数}，可按 house_id 过滤"""
+        docs = {}
+        with self._lock:
+            self._sync()
+            for m in self.metadata:
+                if m.get("deleted"):
+                    continue
+                if house_id is not None and m.get("house_id") != house_id:
+                    continue
+                docs.setdefault(m["doc_id"], 0)
+                docs[m["doc_id"]] += 1
+        return docs
+
+    def delete_document(self, doc_id: str, save: bool = True) -> int:
+        """删除某个文档的全部 chunk，返回删除的数量"""
+        with self._writing():
+            positions = [i for i, m in enumerate(self.metadata) if m.get("doc_id") == doc_id]
+            if not positions:
+                return 0
+            # IndexFlat.remove_ids 会压缩剩余向量并保持原有顺序，metadata 同步删除即可对齐
+            self.index.remove_ids(np.array(positions, dtype="int64"))
+            drop = set(positions)
+            self._tombstones -= sum(1 for i in positions if self.metadata[i].get("deleted"))
+            self.metadata = [m for i, m in enumerate(self.metadata) if i not in drop]
+            self._matrix = None
+            # HNSW / IVF 不支持按位置删除后保持对齐，标记为过期，下次检索时重建
+            if self._ann is not None:
+                self._ann_stale = True
+            if save:
+                self._save()
+            return len(positions)
+
+    def document_vectors(self, doc_id: str) -> Dict[str, np.ndarray]:
+        """某个文档现有（未删除）chunk 的 {chunk_hash: 归一化向量}，增量重建时复用"""
+        with self._lock:
+            self._sync()
+            out = {}
+            for i, m in enumerate(self.metadata):
+                if m.get("doc_id") == doc_id and not m.get("deleted") and m.get("chunk_hash"):
+                    out.setdefault(m["chunk_hash"], self.index.reconstruct(i))
+            return out
+
+    def update_document(self, doc_id: str, vectors: List[List[float]], metadatas: List[dict]) -> Dict[str, int]:
+        """
+        按 metadata["chunk_hash"] 对比新旧 chunk：内容没变的保留原位置（只更新 chunk_id 等 metadata），
+        新增的追加，消失的打 tombstone。返回 {"kept", "added", "removed"}。
+        """
+        with self._writing():
+            live = {}   # chunk_hash -> [位置]（同一文档里可能有重复的 chunk）
+            for i, m in enumerate(self.metadata):
+                if m.get("doc_id") == doc_id and not m.get("deleted"):
+                    live.setdefault(m.get("chunk_hash"), []).append(i)
+            add_vecs, add_metas = [], []
+            kept = 0
+            for v, m in zip(vectors, metadatas):
+                positions = live.get(m.get("chunk_hash")) if m.get("chunk_hash") else None
+                if positions:
+                    self.metadata[positions.pop(0)] = m
+                    kept += 1
+                else:
+                    add_vecs.append(v)
+                    add_metas.append(m)
+            removed = [i for positions in live.values() for i in positions]
+            for i in removed:
+                self.metadata[i] = {"doc_id": doc_id, "deleted": True}
+            self._tombstones += len(removed)
+            self.add(add_vecs, add_metas, save=False)
+            if self._tombstones > TOMBSTONE_COMPACT_RATIO * self.index.ntotal:
+                self._compact()
+            self._save()
+            return {"kept": kept, "added": len(add_metas), "removed": len(removed)}
+
+    def update_document_stream(self, doc_id: str, batches: Iterable[Tuple[List[List[float]], List[dict]]]) -> Dict[str, int]:
+        """
+        update_document 的流式版本：batches 逐批给出 (vectors, metadatas)（边 embedding 边产出）。
+        每批到达时只把新增的 chunk 追加并落盘，内容没变的 chunk 先记下；
+        全部批次结束后再一次性替换没变 chunk 的 metadata、给旧版本里消失的 chunk 打 tombstone。
+        批次之间不持有写锁（embedding 请求期间照常检索），这期间旧版本完整可查。
+        中途出错时把本次追加的 chunk 打 tombstone，旧版本保持不变。返回 {"kept", "added", "removed"}。
+        """
+        rev = uuid.uuid4().hex   # 本次写入追加的 chunk 带上 rev，与旧版本区分（位置可能因其他写入者压缩而移动）
+        kept_metas, claimed, added = [], {}, 0
+
+        def old_live():
+            live = {}   # chunk_hash -> [位置]（同一文档里可能有重复的 chunk）
+            for i, m in enumerate(self.metadata):
+                if m.get("doc_id") == doc_id and not m.get("deleted") and m.get("rev") != rev:
+                    live.setdefault(m.get("chunk_hash"), []).append(i)
+            return live
+
+        try:
+            for vectors, metadatas in batches:
+                with self._writing():
+                    live = old_live()
+                    add_vecs, add_metas = [], []
+                    for v, m in zip(vectors, metadatas):
+                        h = m.get("chunk_hash")
+                        if h and claimed.get(h, 0) < len(live.get(h, ())):
+                            claimed[h] = claimed.get(h, 0) + 1
+                            kept_metas.append(m)
+                        else:
+                            m["rev"] = rev
+                            add_vecs.append(v)
+                            add_metas.append(m)
+                    if add_metas:
+                        self.add(add_vecs, add_metas, save=False)
+                        self._save()
+                        added += len(add_metas)
+        except BaseException:
+            with self._writing():
+                mine = [i for i, m in enumerate(self.metadata) if m.get("doc_id") == doc_id and m.get("rev") == rev]
+                for i in mine:
+                    self.metadata[i] = {"doc_id": doc_id, "deleted": True}
+                self._tombstones += len(mine)
+                if mine:
+                    self._save()
+            raise
+
+        with self._writing():
+            live = old_live()
+            for m in kept_metas:
+                positions = live.get(m["chunk_hash"])
+                if positions:
+                    self.metadata[positions.pop(0)] = m
+            removed = [i for positions in live.values() for i in positions]
+            for i in removed:
+                self.metadata[i] = {"doc_id": doc_id, "deleted": True}
+            self._tombstones += len(removed)
+            if self._tombstones > TOMBSTONE_COMPACT_RATIO * self.index.ntotal:
+                self._compact()
+            if kept_metas or removed:
+                self._save()
+            return {"kept": len(kept_metas), "added": added, "removed": len(removed)}
+
+    def _compact(self):
+        """物理删除所有 tombstone（之后 ANN 需要重建）"""
+        positions = [i for i, m in enumerate(self.metadata) if m.get("deleted")]
+        if not positions:
+            return
+        self.index.remove_ids(np.array(positions, dtype="int64"))
+        self.metadata = [m for m in self.metadata if not m.get("deleted")]
+        self._tombstones = 0
+        self._matrix = None
+        if self._ann is not None:
+            self._ann_stale = True
+        print(f"[vectorstore] Compacted {len(positions)} tombstones ({self.index_path})")
+
+    def replace_document(self, doc_id: str, vectors: List[List[float]], metadatas: List[dict]):
+        """用新的 chunk 替换同一 doc_id 的旧 chunk（只落盘一次）"""
+        with self._writing():
+            self.delete_document(doc_id, save=False)
+            self.add(vectors, metadatas, save=False)
+            self._save()
+
+
+NAMESPACE_FILE = "namespace.txt"   # shard 目录里记录原始 namespace，namespaces() 据此还原
+
+
+class ShardedVectorStore:
+    """
+    每个 namespace（一个 house，或一个用户上传的合同）一个独立的 SimpleVectorStore，
+    各自落盘在 base_dir/<namespace>/ 下、各自持有锁。
+    检索只扫描指定的 shard，耗时只与该 house 的 KB 大小有关；
+    不同 house 的会话并发读写也不会互相覆盖。
+    """
+    def __init__(self, dim: int, base_dir: str, **store_kwargs):
+        self.dim = dim
+        self.base_dir = base_dir
+        self.store_kwargs = store_kwargs    # 透传给每个 SimpleVectorStore（ANN 参数等）
+        self._shards: Dict[str, SimpleVectorStore] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _legacy_name(namespace: str) -> str:
+        # 旧的目录名：不同 namespace 可能映射到同一个目录（user_a@x.com / user_a_x.com），只用于迁移
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", str(namespace))
+
+    @staticmethod
+    def _safe_name(namespace: str) -> str:
+        """shard 目录名：可读前缀 + 原始 namespace 的 sha1，不同 namespace 不会落到同一目录（大小写不敏感的文件系统上也一样）"""
+        namespace = str(namespace)
+        prefix = re.sub(r"[^A-Za-z0-9_.-]", "_", namespace)[:40]
+        return f"{prefix}-{hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:16]}"
+
+    def _shard_dir(self, namespace: str) -> str:
+        shard_dir = os.path.join(self.base_dir, self._safe_name(namespace))
+        if not os.path.isdir(shard_dir):
+            legacy = os.path.join(self.base_dir, self._legacy_name(namespace))
+            # 只有原名本身就是合法目录名时，旧目录才确定属于这个 namespace，直接改名沿用；
+            # 含特殊字符的 namespace 无法判断旧目录归属，不沿用（需重新上传）
+            if self._legacy_name(namespace) == str(namespace) and os.path.exists(os.path.join(legacy, "vector.index")):
+                os.rename(legacy, shard_dir)
+                print(f"[vectorstore] Migrated shard {legacy} -> {shard_dir}")
+        os.makedirs(shard_dir, exist_ok=True)
+        name_path = os.path.join(shard_dir, NAMESPACE_FILE)
+        if not os.path.exists(name_path):
+            with open(name_path, "w", encoding="utf-8") as f:
+                f.write(str(namespace))
+        return shard_dir
+
+    def get(self, namespace: str) -> SimpleVectorStore:
+        with self._lock:
+            store = self._shards.get(namespace)
+            if store is None:
+                shard_dir = self._shard_dir(namespace)
+                store = SimpleVectorStore(
+                    self.dim,
+                    index_path=os.path.join(shard_dir, "vector.index"),
+                    meta_path=os.path.join(shard_dir, "meta.pkl"),
+                    **self.store_kwargs,
+                )
+                self._shards[namespace] = store
+            return store
+
+    def namespaces(self) -> List[str]:
+        """磁盘上已存在的 shard 对应的 namespace（读目录里记录的原始 namespace）"""
+        if not os.path.isdir(self.base_dir):
+            return []
+        out = []
+        for d in os.listdir(self.base_dir):
+            shard_dir = os.path.join(self.base_dir, d)
+            if not os.path.exists(os.path.join(shard_dir, "vector.index")):
                 continue
-            results.append((self.metadata[idx], float(score)))
-        return results
+            try:
+                with open(os.path.join(shard_dir, NAMESPACE_FILE), "r", encoding="utf-8") as f:
+                    out.append(f.read())
+            except OSError:   # 尚未迁移的旧目录：目录名即 namespace
+                out.append(d)
+        return sorted(out)
@@ -0,0 +1,578 @@
+# rag_benchmark.py
+"""
+RAG 基准测试（在项目根目录运行）：
+
+    # 离线：确定性的本地 embedding / LLM 替身 + 临时索引，不联网、不碰 data/ 下的真实索引，可在 CI 里跑
+    # （默认语料为仓库里的 fixtures/tenancy_agreement.txt；--stream 走 query_rag_stream 并记录首 token 延迟）
+    python rag_benchmark.py run --offline --concurrency 8 --out runs/new.json
+    python rag_benchmark.py run --offline --stream --out runs/stream.json
+    # 进程内直接调用 query_rag（真实 embedding / gpt-4o）
+    python rag_benchmark.py run --concurrency 4 --out runs/live.json
+    # 压测已部署的 HTTP API（backend/main.py 的 POST /ask）
+    python rag_benchmark.py run --target http://127.0.0.1:8000 --namespace default --concurrency 16
+    # 对比两次运行，出现回归时以非 0 退出
+    python rag_benchmark.py compare runs/base.json runs/new.json
+
+每次运行把问题集按给定并发重放 repeat 遍，记录：
+- 延迟 p50 / p95 / p99（总耗时，进程内目标还按阶段拆分：embed / search / llm；流式时另有 ttft 首 token 延迟）
+- 吞吐量（请求数 / 墙钟时间）
+- 质量：ROUGE-L / EM / 语义相似度及加权分（与 validate_rag.py 的口径一致）
+语义相似度复用流水线自己的 embed_texts（离线时即替身 embedding），不再额外加载一个 SentenceTransformer。
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# ===========================================
+# 🔧 默认参数
+# ===========================================
+DEFAULT_DOC = "Track_B_Tenancy_Agreement.pdf"
+OFFLINE_DOC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "tenancy_agreement.txt")
+BENCH_NAMESPACE = "default"
+STAGES = ("total", "ttft", "embed", "search", "llm")
+PIPELINE_STAGES = ("embed", "search")   # llm = total - 这些阶段；ttft 与它们重叠，不参与相减
+PERCENTILES = (50, 95, 99)
+# 离线替身的模拟耗时（固定值，保证多次运行可比）
+STUB_EMBED_LATENCY_MS = 5.0
+STUB_LLM_LATENCY_MS = 50.0
+STUB_TTFT_FRACTION = 0.4        # 流式时首个 token 在 STUB_LLM_LATENCY_MS 的这一比例处到达，其余平摊到后续 token
+# compare 的回归判定：延迟 / 吞吐量按相对变化，质量按绝对下降
+LATENCY_TOLERANCE = 0.10
+LATENCY_FLOOR_MS = 1.0          # 小于这个绝对差值的延迟波动不算回归
+THROUGHPUT_TOLERANCE = 0.10
+QUALITY_TOLERANCE = 0.02
+# 加权分：与 validate_rag.py 相同
+SCORE_WEIGHTS = {"rouge_l": 0.4, "em": 0.3, "semantic": 0.3}
+# ===========================================
+
+# 租约问答评测集（问题, 参考答案）
+TENANCY_QUESTIONS = [
+    ("What is the monthly rental amount?", "S$7500 per month."),
+    ("Who is the landlord of the property?", "Peter Richardson Williams."),
+    ("When does the tenancy start?", "22 February 2024."),
+    ("How much is the security deposit?", "S$15000, equivalent to two months’ rent."),
+    ("What is the address of the rented premises?", "88 Orchard Boulevard #15-03, Singapore 238863."),
+    ("What is the tenant responsible for regarding minor repairs?", "Tenant responsible for repairs up to S$200 per item; landlord covers the rest."),
+    ("Who pays for aircon servicing?", "Landlord is responsible for servicing and fair wear repairs."),
+    ("How long is the defect-free period?", "30 days from the start date."),
+    ("What happens if the tenant sublets without permission?", "It constitutes a breach and may lead to termination."),
+    ("Who bears the property tax?", "The landlord."),
+    ("Under what conditions can the tenant terminate the lease early?", "After 12 months if transferred, deported, or denied residence (diplomatic clause)."),
+    ("What happens if rent is unpaid for more than 7 days?", "Landlord can re-enter and terminate the tenancy."),
+    ("How is the late payment interest calculated?", "Monthly rent × 10% ÷ 365 × number of late days."),
+    ("What are the landlord’s obligations regarding repairs?", "Maintain structure, wiring, pipes; repair within 14 days after notice."),
+    ("What are the tenant’s obligations regarding pets?", "Tenant cannot keep pets without landlord’s written consent."),
+    ("How is damage due to acts of God treated?", "Not the tenant’s responsibility."),
+    ("What should the landlord do before letting out a mortgaged property?", "Obtain written consent from the financial institution."),
+    ("How long before expiry should the tenant request renewal?", "At least 2 months before expiry."),
+    ("When can the landlord terminate due to en-bloc redevelopment?", "With 3 months’ written notice."),
+    ("What are the conditions for rent suspension?", "If the property becomes uninhabitable due to causes beyond both parties’ control."),
+]
+
+
+def load_questions(path=None):
+    """
+    问题集：None 为内置的 TENANCY_QUESTIONS；
+    否则读取 JSON 列表或 JSONL，每条为 {"question": ..., "reference": ...}
+    """
+    if path is None:
+        return list(TENANCY_QUESTIONS)
+    with open(path, encoding="utf-8") as f:
+        raw = f.read()
+    if path.endswith(".jsonl"):
+        items = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    else:
+        items = json.loads(raw)
+    return [(it["question"], it.get("reference", "")) for it in items]
+
+
+# ===========================================
+# 🧪 离线替身：确定性的 embedding + LLM
+# ===========================================
+def stub_embed(texts, dim, latency_ms=0.0):
+    """
+    特征哈希的词袋向量（blake2b，跨进程稳定）并 L2 归一化：
+    同一文本永远得到同一向量，词重合越多余弦相似度越高，足以让检索和语义分有意义。
+    """
+    from backend.embeddings import lexical_tokens
+    if latency_ms:
+        time.sleep(latency_ms / 1000)
+    out = np.zeros((len(texts), dim), dtype="float32")
+    for i, text in enumerate(texts):
+        for tok in lexical_tokens(text):
+            h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+            out[i, h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(out[i])
+        if norm > 0:
+            out[i] /= norm
+    return out
+
+
+def stub_answer(prompt):
+    """从 prompt 的 <context> 中挑出与 <question> 词重合最多的一句作为回答"""
+    from backend.embeddings import lexical_tokens
+
+    def between(tag):
+        m = re.search(rf"<{tag}>(.*?)</{tag}>", prompt, re.S)
+        return m.group(1).strip() if m else ""
+
+    q_tokens = set(lexical_tokens(between("question")))
+    best, best_score = None, 0
+    for sent in re.split(r"(?<=[.!?])\s+|\n+", between("context")):
+        score = len(q_tokens & set(lexical_tokens(sent)))
+        if score > best_score:
+            best, best_score = sent.strip(), score
+    return best[:400] if best else "The provided documents do not mention this information."
+
+
+class StubLLMClient:
+    """
+    实现流水线用到的那部分 OpenAI client 接口（embeddings.create / chat.completions.create），
+    结果确定、耗时固定，不发任何网络请求。
+    """
+    def __init__(self, dim, embed_latency_ms=STUB_EMBED_LATENCY_MS, llm_latency_ms=STUB_LLM_LATENCY_MS):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.llm_latency_ms = llm_latency_ms
+        self.embeddings = SimpleNamespace(create=self._embed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+
+    def _embed(self, input, model=None, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        vecs = stub_embed(texts, self.dim, self.embed_latency_ms)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=v) for v in vecs])
+
+    def _chat(self, model=None, messages=(), stream=False, **kwargs):
+        answer = stub_answer(messages[-1]["content"])
+        if stream:
+            return self._stream(answer)
+        time.sleep(self.llm_latency_ms / 1000)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+    def _stream(self, answer):
+        """与 OpenAI 流式响应同形的增量 chunk（每个词一段），总耗时仍为 llm_latency_ms"""
+        pieces = re.findall(r"\S+\s*", answer) or [answer]
+        first = self.llm_latency_ms * STUB_TTFT_FRACTION / 1000
+        rest = self.llm_latency_ms * (1 - STUB_TTFT_FRACTION) / 1000 / len(pieces)
+        for n, piece in enumerate(pieces):
+            time.sleep(first if n == 0 else rest)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+@contextlib.contextmanager
+def _patched(module, **attrs):
+    old = {k: getattr(module, k) for k in attrs}
+    for k, v in attrs.items():
+        setattr(module, k, v)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            setattr(module, k, v)
+
+
+@contextlib.contextmanager
+def offline_pipeline(work_dir, embed_latency_ms=STUB_EMBED_LATENCY_MS, llm_latency_ms=STUB_LLM_LATENCY_MS):
+    """
+    在 with 块内把 rag_pipeline 换成离线配置：
+    client / 单批 embedding 换成 StubLLMClient，索引、文档抽取缓存、文档 embedding 缓存都写到 work_dir，
+    文本 embedding 缓存只在内存里。退出时全部恢复，data/ 下的索引和缓存不受影响。
+    """
+    from backend import rag_pipeline as rp
+    from backend import document_parser, embed_cache
+    from backend.embed_cache import TextEmbeddingCache
+    from backend.vectorstore import ShardedVectorStore
+
+    client = StubLLMClient(rp.EMBED_DIM, embed_latency_ms, llm_latency_ms)
+    stores = ShardedVectorStore(rp.EMBED_DIM, os.path.join(work_dir, "vector_index"), **rp.stores.store_kwargs)
+    with _patched(
+        rp,
+        get_client=lambda: client,
+        _embed_batch=lambda texts: stub_embed(list(texts), rp.EMBED_DIM, embed_latency_ms),
+        stores=stores,
+        text_cache=TextEmbeddingCache("benchmark-stub", max_entries=rp.EMBED_LRU_SIZE),
+    ), _patched(
+        document_parser, EXTRACT_CACHE_DIR=os.path.join(work_dir, "extract_cache"),
+    ), _patched(
+        embed_cache, CACHE_DIR=os.path.join(work_dir, "embed_cache"),
+    ):
+        os.makedirs(embed_cache.CACHE_DIR, exist_ok=True)
+        yield rp
+
+
+# ===========================================
+# 🎯 被测目标
+# ===========================================
+_stage_times = threading.local()
+
+
+def _timed(stage, fn):
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _stage_times.ms[stage] = _stage_times.ms.get(stage, 0.0) + (time.perf_counter() - t0) * 1000
+    return wrapper
+
+
+class InProcessTarget:
+    """
+    直接调用 rag_pipeline.query_rag（stream=True 时为 Chat 页面用的 query_rag_stream，并记录首 token 延迟 ttft）。
+    embed / search 两个阶段通过包装 embed_texts、_retrieve_context 计时，
+    llm = 总耗时 - embed - search（prompt 构造 + 生成 + 答案缓存读写）。
+    默认关闭语义答案缓存，否则重复的问题测到的只是缓存命中。
+    """
+    def __init__(self, namespace=BENCH_NAMESPACE, top_k=8, answer_cache=False, stream=False):
+        from backend import rag_pipeline
+        self.rp = rag_pipeline
+        self.namespace = namespace
+        self.top_k = top_k
+        self.answer_cache = answer_cache
+        self.stream = stream
+        self.name = "query_rag_stream" if stream else "query_rag"
+
+    @contextlib.contextmanager
+    def session(self):
+        from backend.answer_cache import SemanticAnswerCache
+        attrs = {
+            "embed_texts": _timed("embed", self.rp.embed_texts),
+            "_retrieve_context": _timed("search", self.rp._retrieve_context),
+        }
+        if not self.answer_cache:
+            attrs["answer_cache"] = SemanticAnswerCache(max_entries=0)
+        with _patched(self.rp, **attrs):
+            yield
+
+    def ask(self, question):
+        _stage_times.ms = {}
+        if not self.stream:
+            answer = self.rp.query_rag(question, top_k=self.top_k, namespace=self.namespace)
+            return answer, dict(_stage_times.ms)
+        t0 = time.perf_counter()
+        parts = []
+        for piece in self.rp.query_rag_stream(question, top_k=self.top_k, namespace=self.namespace):
+            if not parts:
+                _stage_times.ms["ttft"] = (time.perf_counter() - t0) * 1000
+            parts.append(piece)
+        return "".join(parts).strip(), dict(_stage_times.ms)
+
+
+class HttpTarget:
+    """
+    POST {base_url}/ask；只能测到端到端耗时（含网络），没有阶段拆分。
+    stream=True 时改为 POST /ask/stream（SSE），另外记录首个 data 事件到达的时间（ttft）。
+    """
+    def __init__(self, base_url, namespace=None, top_k=8, timeout=120.0, stream=False):
+        import httpx
+        self.url = base_url.rstrip("/") + ("/ask/stream" if stream else "/ask")
+        self.namespace = namespace
+        self.top_k = top_k
+        self.stream = stream
+        self.name = "http_stream" if stream else "http"
+        self._client = httpx.Client(timeout=timeout, limits=httpx.Limits(max_connections=64))
+
+    @contextlib.contextmanager
+    def session(self):
+        try:
+            yield
+        finally:
+            self._client.close()
+
+    def ask(self, question):
+        data = {"question": question, "top_k": self.top_k}
+        if self.namespace:
+            data["namespace"] = self.namespace
+        if not self.stream:
+            resp = self._client.post(self.url, data=data)
+            resp.raise_for_status()
+            return resp.json()["answer"], {}
+        t0 = time.perf_counter()
+        parts, stages, event = [], {}, None
+        with self._client.stream("POST", self.url, data=data) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    payload = json.loads(line[5:])
+                    if event == "error":
+                        raise RuntimeError(payload.get("message", "stream error"))
+                    if "delta" in payload:
+                        if not parts:
+                            stages["ttft"] = (time.perf_counter() - t0) * 1000
+                        parts.append(payload["delta"])
+                elif not line:
+                    event = None
+        return "".join(parts).strip(), stages
+
+
+# ===========================================
+# 📏 质量评分
+# ===========================================
+class Scorer:
+    """
+    ROUGE-L（rouge_score）/ EM（参考答案是否出现在回答中）/ 语义相似度（embed_fn 向量的余弦）。
+    embed_fn 默认用 models/ 下的 all-MiniLM-L6-v2（fp32），与最初的 validate_rag.py 相同，
+    语义分数的量纲不随流水线的 embedding 模型变化；评分也不经过流水线的 embedding 缓存，不写 data/。
+    """
+    def __init__(self, embed_fn=None):
+        from rouge_score import rouge_scorer
+        self._rouge = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=True)
+        if embed_fn is None:
+            from backend.local_embedder import load_model
+            model, _ = load_model("torch")
+            embed_fn = lambda texts: model.encode(list(texts), convert_to_numpy=True)
+        self._embed = embed_fn
+
+    def score(self, reference, prediction):
+        rouge_l = self._rouge.score(reference, prediction)["rougeL"].fmeasure
+        em = 1.0 if reference.lower().strip() in prediction.lower() else 0.0
+        a, b = np.asarray(self._embed([reference, prediction]), dtype="float32")
+        semantic = float(a @ b / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+        scores = {"rouge_l": rouge_l, "em": em, "semantic": semantic}
+        scores["final"] = sum(SCORE_WEIGHTS[k] * scores[k] for k in SCORE_WEIGHTS)
+        return scores
+
+
+# ===========================================
+# 🏃 运行 / 汇总
+# ===========================================
+def ensure_corpus(doc_path, namespace=BENCH_NAMESPACE):
+    """namespace 为空时把 doc_path 写入索引（与 validate_rag.py 一样只建一次）"""
+    from backend import rag_pipeline as rp
+    if rp.is_fitted(namespace):
+        return
+    if not os.path.exists(doc_path):
+        raise FileNotFoundError(f"Benchmark corpus not found: {doc_path} (pass --doc, or use --offline for the bundled fixture)")
+    from backend.document_parser import extract_text
+    with open(doc_path, "rb") as f:
+        text = extract_text(doc_path, f.read())
+    print(f"🔧 Building knowledge base from {doc_path}...")
+    rp.add_document_from_file(text, file_type="txt", namespace=namespace)
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    arr = np.asarray(values, dtype="float64")
+    out = {f"p{p}": float(np.percentile(arr, p)) for p in PERCENTILES}
+    out["mean"] = float(arr.mean())
+    return out
+
+
+def summarize(results, wall_seconds):
+    ok = [r for r in results if r["error"] is None]
+    latency = {}
+    for stage in STAGES:
+        values = [r["latency_ms"][stage] for r in ok if stage in r["latency_ms"]]
+        if values:
+            latency[stage] = _percentiles(values)
+    quality = {}
+    scored = [r for r in ok if r.get("scores")]
+    for k in (*SCORE_WEIGHTS, "final"):
+        if scored:
+            quality[k] = float(np.mean([r["scores"][k] for r in scored]))
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(ok) / wall_seconds if wall_seconds > 0 else 0.0,
+        "latency_ms": latency,
+        "quality": quality,
+    }
+
+
+def run_benchmark(target, questions, concurrency=1, repeat=1, warmup=1, scorer=None):
+    """
+    按 concurrency 个并发重放 questions（共 repeat 遍），返回 {"meta", "summary", "results"}。
+    正式计时前先顺序跑 warmup 个问题（模型加载、连接建立不计入结果）。
+    """
+    jobs = [(i, q, ref) for _ in range(repeat) for i, (q, ref) in enumerate(questions)]
+
+    def one(job):
+        i, q, ref = job
+        t0 = time.perf_counter()
+        try:
+            answer, stages = target.ask(q)
+            error = None
+        except Exception as e:
+            answer, stages, error = "", {}, f"{type(e).__name__}: {e}"
+        total = (time.perf_counter() - t0) * 1000
+        latency = {"total": total, **stages}
+        if any(s in stages for s in PIPELINE_STAGES):
+            latency["llm"] = max(0.0, total - sum(stages.get(s, 0.0) for s in PIPELINE_STAGES))
+        return {"index": i, "question": q, "reference": ref, "answer": answer,
+                "latency_ms": latency, "error": error}
+
+    with target.session():
+        for _, q, _ in jobs[:warmup]:
+            target.ask(q)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            results = list(pool.map(one, jobs))
+        wall = time.perf_counter() - t0
+
+    # 评分放在计时之外，不影响延迟 / 吞吐量
+    if scorer is not None:
+        for r in results:
+            if r["error"] is None:
+                r["scores"] = scorer.score(r["reference"], r["answer"])
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "target": target.name,
+            "concurrency": concurrency,
+            "repeat": repeat,
+            "questions": len(questions),
+        },
+        "summary": summarize(results, wall),
+        "results": results,
+    }
+
+
+def print_summary(run):
+    s = run["summary"]
+    meta = run["meta"]
+    print(f"📊 {meta['target']} × concurrency {meta['concurrency']}: {s['requests']} requests, "
+          f"{s['errors']} errors, {s['wall_seconds']:.2f}s, {s['throughput_rps']:.2f} req/s")
+    for stage, p in s["latency_ms"].items():
+        print(f"   {stage:>6}: " + "  ".join(f"{k}={v:.1f}ms" for k, v in p.items()))
+    if s["quality"]:
+        print("   quality: " + "  ".join(f"{k}={v:.3f}" for k, v in s["quality"].items()))
+
+
+# ===========================================
+# 🔍 两次运行对比
+# ===========================================
+def compare_runs(base, new, latency_tolerance=LATENCY_TOLERANCE,
+                 throughput_tolerance=THROUGHPUT_TOLERANCE, quality_tolerance=QUALITY_TOLERANCE):
+    """
+    返回 [(指标, 基线值, 新值, 是否回归)]：
+    延迟上升超过 latency_tolerance（且绝对差 > LATENCY_FLOOR_MS）、吞吐量下降超过 throughput_tolerance、
+    质量下降超过 quality_tolerance、错误数增加，都算回归。
+    """
+    b, n = base["summary"], new["summary"]
+    rows = []
+    for stage, pb in b["latency_ms"].items():
+        pn = n["latency_ms"].get(stage, {})
+        for k in (f"p{p}" for p in PERCENTILES):
+            if k in pb and k in pn:
+                worse = pn[k] > pb[k] * (1 + latency_tolerance) and pn[k] - pb[k] > LATENCY_FLOOR_MS
+                rows.append((f"latency_ms.{stage}.{k}", pb[k], pn[k], worse))
+    rows.append(("throughput_rps", b["throughput_rps"], n["throughput_rps"],
+                 n["throughput_rps"] < b["throughput_rps"] * (1 - throughput_tolerance)))
+    for k, vb in b["quality"].items():
+        if k in n["quality"]:
+            rows.append((f"quality.{k}", vb, n["quality"][k], n["quality"][k] < vb - quality_tolerance))
+    rows.append(("errors", b["errors"], n["errors"], n["errors"] > b["errors"]))
+    return rows
+
+
+def print_comparison(rows):
+    for name, vb, vn, worse in rows:
+        change = f"{(vn - vb) / vb * 100:+.1f}%" if vb else "n/a"
+        print(f"{'❌' if worse else '  '} {name:<28} {vb:>10.3f} → {vn:>10.3f}  ({change})")
+    regressions = [r for r in rows if r[3]]
+    print(f"{'❌' if regressions else '✅'} {len(regressions)} regression(s)")
+    return regressions
+
+
+# ===========================================
+# 🖥 命令行
+# ===========================================
+def _run_command(args):
+    questions = load_questions(args.questions)
+    with contextlib.ExitStack() as stack:
+        if args.doc is None:
+            args.doc = OFFLINE_DOC if args.offline else DEFAULT_DOC
+        if args.target:
+            target = HttpTarget(args.target, namespace=args.namespace, top_k=args.top_k, stream=args.stream)
+        else:
+            if args.offline:
+                import tempfile
+                work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="rag-bench-"))
+                stack.enter_context(offline_pipeline(work_dir, args.stub_embed_ms, args.stub_llm_ms))
+            namespace = args.namespace or BENCH_NAMESPACE
+            ensure_corpus(args.doc, namespace)
+            target = InProcessTarget(namespace=namespace, top_k=args.top_k, answer_cache=args.answer_cache,
+                                     stream=args.stream)
+        scorer = None
+        if not args.no_quality:
+            try:
+                scorer = Scorer()
+            except ImportError as e:   # 离线冒烟测试允许没装 sentence-transformers，只是不评分
+                if not args.offline:
+                    raise
+                print(f"⚠️ Quality scoring skipped ({e}); install sentence-transformers to score offline runs")
+        run = run_benchmark(target, questions, concurrency=args.concurrency,
+                            repeat=args.repeat, warmup=args.warmup, scorer=scorer)
+    run["meta"].update({"offline": bool(args.offline and not args.target), "doc": args.doc, "top_k": args.top_k})
+    print_summary(run)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(run, f, ensure_ascii=False, indent=2)
+        print(f"✅ Saved run to {args.out}")
+    return 1 if run["summary"]["errors"] else 0
+
+
+def _compare_command(args):
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    rows = compare_runs(base, new, args.latency_tolerance, args.throughput_tolerance, args.quality_tolerance)
+    return 1 if print_comparison(rows) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG latency / throughput / quality benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="replay a question set and record latency, throughput and quality")
+    run.add_argument("--target", help="HTTP API base URL (default: call query_rag in-process)")
+    run.add_argument("--offline", action="store_true", help="deterministic local embedding / LLM stubs")
+    run.add_argument("--doc", help=f"document indexed when the namespace is empty "
+                                   f"(default: {DEFAULT_DOC}; with --offline the bundled fixtures/tenancy_agreement.txt)")
+    run.add_argument("--stream", action="store_true", help="use the streaming path and record time to first token")
+    run.add_argument("--questions", help="JSON / JSONL question set (default: built-in tenancy questions)")
+    run.add_argument("--namespace", help=f"index shard to query (default: {BENCH_NAMESPACE})")
+    run.add_argument("--concurrency", type=int, default=1)
+    run.add_argument("--repeat", type=int, default=1, help="replay the question set this many times")
+    run.add_argument("--warmup", type=int, default=1, help="untimed requests sent before the run")
+    run.add_argument("--top-k", type=int, default=8)
+    run.add_argument("--answer-cache", action="store_true", help="keep the semantic answer cache enabled")
+    run.add_argument("--no-quality", action="store_true", help="skip ROUGE-L / EM / semantic scoring")
+    run.add_argument("--stub-embed-ms", type=float, default=STUB_EMBED_LATENCY_MS)
+    run.add_argument("--stub-llm-ms", type=float, default=STUB_LLM_LATENCY_MS)
+    run.add_argument("--out", help="write the run (summary + per-request results) to this JSON file")
+    run.set_defaults(func=_run_command)
+
+    cmp = sub.add_parser("compare", help="compare two saved runs; exit 1 on regressions")
+    cmp.add_argument("base")
+    cmp.add_argument("new")
+    cmp.add_argument("--latency-tolerance", type=float, default=LATENCY_TOLERANCE)
+    cmp.add_argument("--throughput-tolerance", type=float, default=THROUGHPUT_TOLERANCE)
+    cmp.add_argument("--quality-tolerance", type=float, default=QUALITY_TOLERANCE)
+    cmp.set_defaults(func=_compare_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+# startup_budget.py
+"""
+登录页冷启动预算检查（在项目根目录运行）：
+    python startup_budget.py
+
+1. 测量登录页用到的后端模块的导入耗时，要求 ≤ IMPORT_BUDGET_MS
+2. 用 streamlit 的 AppTest 渲染一次登录页，要求 ≤ RENDER_BUDGET_MS 且没有报错
+3. 检查渲染完成后没有加载任何 ML / RAG 依赖（HEAVY_MODULES）
+任何一项不满足时以非 0 退出。
+"""
+import os
+import sys
+import time
+import importlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_BUDGET_MS = 300
+RENDER_BUDGET_MS = 2000
+LOGIN_MODULES = ("backend.db", "backend.users", "backend.house_kb", "backend.ingest_jobs", "backend.tickets")
+HEAVY_MODULES = (
+    "torch", "sentence_transformers", "transformers", "faiss", "sklearn",
+    "langchain_text_splitters", "openai", "pymupdf", "fitz", "pdfplumber", "pytesseract",
+    "tiktoken", "backend.rag_pipeline", "backend.vectorstore",
+)
+
+
+def main() -> int:
+    failures = []
+
+    t0 = time.perf_counter()
+    for name in LOGIN_MODULES:
+        importlib.import_module(name)
+    import_ms = (time.perf_counter() - t0) * 1000
+    print(f"Login-path backend imports: {import_ms:.0f} ms (budget {IMPORT_BUDGET_MS} ms)")
+    if import_ms > IMPORT_BUDGET_MS:
+        failures.append("import budget exceeded")
+
+    from streamlit.testing.v1 import AppTest
+    t0 = time.perf_counter()
+    at = AppTest.from_file("app.py", default_timeout=60).run()
+    render_ms = (time.perf_counter() - t0) * 1000
+    print(f"Login page render: {render_ms:.0f} ms (budget {RENDER_BUDGET_MS} ms)")
+    if at.exception:
+        failures.append(f"login page raised: {[e.message for e in at.exception]}")
+    if render_ms > RENDER_BUDGET_MS:
+        failures.append("render budget exceeded")
+
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    print(f"Heavy modules loaded: {loaded or 'none'}")
+    if loaded:
+        failures.append(f"login page loaded {loaded}")
+
+    for f in failures:
+        print(f"❌ {f}")
+    if not failures:
+        print("✅ Login page within startup budget")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
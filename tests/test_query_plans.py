@@ -0,0 +1,33 @@
+# tests/test_query_plans.py
+"""迁移后的库上，热点查询必须全部走索引：不能出现 SCAN <table>，分页查询也不能用临时 B-tree 排序"""
+import sqlite3
+
+import pytest
+
+from backend import db
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    db.migrate(conn)
+    yield conn
+    conn.close()
+
+
+def test_migrations_reach_schema_version(conn):
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+
+
+@pytest.mark.parametrize("name", sorted(db.HOT_QUERIES))
+def test_hot_query_uses_index(conn, name):
+    plan = db.query_plans(conn)[name]
+    scans = [d for d in plan if d.startswith("SCAN ")]
+    assert not scans, f"{name} scans a table:\n    " + "\n    ".join(plan)
+
+
+@pytest.mark.parametrize("name", sorted(db.PAGINATED_QUERIES))
+def test_paginated_query_has_no_temp_sort(conn, name):
+    plan = db.query_plans(conn)[name]
+    assert not any("TEMP B-TREE" in d for d in plan), f"{name} sorts every page:\n    " + "\n    ".join(plan)
@@ -1,92 +1,43 @@
 # validate_rag.py
+# 租约问答验收：20 个问题顺序跑一遍，逐题结果写入 rag_validation_report.xlsx。
+# 计时 / 评分 / 并发压测 / 两次运行对比都在 rag_benchmark.py 中（python rag_benchmark.py run --help）
 import pandas as pd
-from backend.rag_pipeline import query_rag, add_document_from_file, is_fitted
-from rouge_score import rouge_scorer
-from sentence_transformers import SentenceTransformer, util
-import numpy as np
-import time
-import fitz  # PyMuPDF for PDF reading
+from backend.rag_pipeline import text_cache
+from backend import llm_client
+import rag_benchmark as bench
 
-# ====== Step 1: Prepare RAG Knowledge Base ======
-def load_pdf_text(pdf_path):
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
-
-if not is_fitted():
-    print("🔧 Building knowledge base from Tenancy Agreement...")
-    text = load_pdf_text("Track_B_Tenancy_Agreement.pdf")
-    add_document_from_file(text, file_type="txt")
+# ====== Step 0: Shared OpenAI client ======
+# 设置 OPENAI_BASE_URL 可把评测指向本地替身服务；这里先建好共享 client，
+# 之后的 embedding / chat 调用都复用同一个连接池
+llm_client.get_client()
 
-# ====== Step 2: Define 20 Evaluation Questions ======
-questions = [
-    ("What is the monthly rental amount?", "S$7500 per month."),
-    ("Who is the landlord of the property?", "Peter Richardson Williams."),
-    ("When does the tenancy start?", "22 February 2024."),
-    ("How much is the security deposit?", "S$15000, equivalent to two months’ rent."),
-    ("What is the address of the rented premises?", "88 Orchard Boulevard #15-03, Singapore 238863."),
-    ("What is the tenant responsible for regarding minor repairs?", "Tenant responsible for repairs up to S$200 per item; landlord covers the rest."),
-    ("Who pays for aircon servicing?", "Landlord is responsible for servicing and fair wear repairs."),
-    ("How long is the defect-free period?", "30 days from the start date."),
-    ("What happens if the tenant sublets without permission?", "It constitutes a breach and may lead to termination."),
-    ("Who bears the property tax?", "The landlord."),
-    ("Under what conditions can the tenant terminate the lease early?", "After 12 months if transferred, deported, or denied residence (diplomatic clause)."),
-    ("What happens if rent is unpaid for more than 7 days?", "Landlord can re-enter and terminate the tenancy."),
-    ("How is the late payment interest calculated?", "Monthly rent × 10% ÷ 365 × number of late days."),
-    ("What are the landlord’s obligations regarding repairs?", "Maintain structure, wiring, pipes; repair within 14 days after notice."),
-    ("What are the tenant’s obligations regarding pets?", "Tenant cannot keep pets without landlord’s written consent."),
-    ("How is damage due to acts of God treated?", "Not the tenant’s responsibility."),
-    ("What should the landlord do before letting out a mortgaged property?", "Obtain written consent from the financial institution."),
-    ("How long before expiry should the tenant request renewal?", "At least 2 months before expiry."),
-    ("When can the landlord terminate due to en-bloc redevelopment?", "With 3 months’ written notice."),
-    ("What are the conditions for rent suspension?", "If the property becomes uninhabitable due to causes beyond both parties’ control.")
-]
+# ====== Step 1: Prepare RAG Knowledge Base ======
+bench.ensure_corpus(bench.DEFAULT_DOC)
 
-# ====== Step 3: Scorers ======
-rouge = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=True)
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# ====== Step 2: Evaluate the 20 tenancy questions (one at a time) ======
+# 语义相似度与最初一样用本地 all-MiniLM-L6-v2（见 rag_benchmark.Scorer），不经过流水线的 embedding 缓存
+run = bench.run_benchmark(
+    bench.InProcessTarget(), bench.TENANCY_QUESTIONS, concurrency=1, warmup=0, scorer=bench.Scorer()
+)
+bench.print_summary(run)
 
-# ====== Step 4: Evaluation Loop ======
+# ====== Step 3: Save Results ======
 results = []
-for q, ref in questions:
-    print(f"🔹 Evaluating: {q}")
-    start = time.time()
-    try:
-        pred = query_rag(q)
-    except Exception as e:
-        pred = f"[Error: {e}]"
-    elapsed = time.time() - start
-
-    # Compute ROUGE-L
-    r = rouge.score(ref, pred)['rougeL']
-    rouge_l = r.fmeasure
-
-    # Compute semantic similarity
-    emb_ref = model.encode(ref, convert_to_tensor=True)
-    emb_pred = model.encode(pred, convert_to_tensor=True)
-    sem_sim = util.cos_sim(emb_ref, emb_pred).item()
-
-    # Compute Exact Match (for factual Qs)
-    em = 1.0 if ref.lower().strip() in pred.lower() else 0.0
-
-    # Weighted score
-    final_score = 0.4 * rouge_l + 0.3 * em + 0.3 * sem_sim
-
+for r in run["results"]:
+    scores = r.get("scores") or {}
     results.append({
-        "Question": q,
-        "Reference": ref,
-        "Prediction": pred,
-        "ROUGE-L": round(rouge_l, 3),
-        "EM": em,
-        "SemanticSim": round(sem_sim, 3),
-        "Time(s)": round(elapsed, 2),
-        "FinalScore": round(final_score, 3)
+        "Question": r["question"],
+        "Reference": r["reference"],
+        "Prediction": r["answer"] if r["error"] is None else f"[Error: {r['error']}]",
+        "ROUGE-L": round(scores.get("rouge_l", 0.0), 3),
+        "EM": scores.get("em", 0.0),
+        "SemanticSim": round(scores.get("semantic", 0.0), 3),
+        "Time(s)": round(r["latency_ms"]["total"] / 1000, 2),
+        "FinalScore": round(scores.get("final", 0.0), 3),
     })
 
-# ====== Step 5: Save Results ======
 df = pd.DataFrame(results)
 df.loc["Average"] = df.mean(numeric_only=True)
 df.to_excel("rag_validation_report.xlsx", index=False)
 print("✅ Validation completed. Results saved to rag_validation_report.xlsx")
+print(f"📊 Embedding cache: {text_cache.stats()}")